@@ -0,0 +1,278 @@
+"""
+加密吞吐量基准测试(离线运行)
+
+对每个 算法 x 后端 x 密文格式/并行方式/I/O方式 x 分块大小 x 文件大小 组合,
+通过公开入口 encrypt_file / decrypt_file_to_path / decrypt_file 加解密随机生成的文件,
+统计吞吐量(MB/s)、峰值内存(RSS) 和 p50/p99 耗时, 以JSON格式输出.
+每个组合的每种操作在独立的子进程中运行, 峰值内存互不影响, 数据库和密文写入临时目录, 不影响正式数据.
+
+用法:
+    python -m benchmark.bench_crypto --sizes 1K,1M,64M --output bench.json
+    python -m benchmark.bench_crypto --sizes 1K,1M,64M --baseline bench.json --tolerance 0.1
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from multiprocessing import get_context
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块
+    resource = None
+
+DEFAULT_SIZES = '1K,64K,1M,16M,256M'
+DEFAULT_CHUNK_SIZES = '1M'
+# 密文格式/并行方式/I/O方式: 名称 -> (blob_format, 是否并行, io_strategy)
+VARIANTS = {
+    'cbc': ('cbc', False, 'buffered'),
+    'cbc-mmap': ('cbc', False, 'mmap'),
+    'segment': ('segment', False, 'buffered'),
+    'segment-mmap': ('segment', False, 'mmap'),
+    'segment-parallel': ('segment', True, 'buffered'),
+}
+OPERATIONS = ('encrypt', 'decrypt', 'decrypt_memory')  # 按顺序运行, 解密使用 encrypt 生成的密文
+IN_MEMORY_LIMIT = 64 * 1024 * 1024  # 超过该大小不测试一次性返回明文的 decrypt_file
+PASSWORD = 'bench'  # 不超过所有算法的密码长度上限
+UNITS = {'K': 1024, 'M': 1024**2, 'G': 1024**3}
+
+
+def parse_size(text: str) -> int:
+    """解析 1K / 64M / 2G 形式的大小"""
+    text = text.strip().upper().rstrip('B')
+    if text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+
+def format_size(size: int) -> str:
+    for unit in ('G', 'M', 'K'):
+        if size >= UNITS[unit] and size % UNITS[unit] == 0:
+            return f'{size // UNITS[unit]}{unit}'
+    return str(size)
+
+
+def percentile(values: list, p: float) -> float:
+    """最近秩法求百分位数"""
+    ordered = sorted(values)
+    index = max(0, -(-len(ordered) * p // 100) - 1)
+    return ordered[int(index)]
+
+
+def peak_rss_mb() -> float | None:
+    """当前进程峰值常驻内存(MB)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为KB, macOS 为字节
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def generate_payload(work_dir: Path, size: int) -> Path:
+    """生成指定大小的随机(不可压缩)文件"""
+    path = work_dir / f'payload_{format_size(size)}.bin'
+    if not path.exists():
+        with open(path, 'wb') as f:
+            remaining = size
+            while remaining:
+                chunk = min(remaining, 4 * 1024 * 1024)
+                f.write(os.urandom(chunk))
+                remaining -= chunk
+    return path
+
+
+def run_case(case: dict, operation: str) -> dict | None:
+    """在子进程中运行一个测试组合的一种操作, 数据库日志输出到标准错误, 不污染JSON结果"""
+    with redirect_stdout(sys.stderr):
+        return _run_operation(case, operation)
+
+
+def _run_operation(case: dict, operation: str) -> dict | None:
+    """
+    重复运行一种操作并统计耗时, 每种操作在独立的子进程中运行, 峰值内存只反映该操作
+    encrypt 最后一次生成的密文保存到数据库, 供同一组合后续的解密操作使用
+    """
+    from setting.config_loader import config
+
+    # 导入数据库和加密模块之前切换到临时目录, 不影响正式数据; 同一组合的各操作进程共用数据库和上传目录
+    case_dir = Path(case['case_dir'])
+    case_dir.mkdir(exist_ok=True)
+    config.path.db_file = str(case_dir / 'bench.db')
+    config.path.upload = str(case_dir / 'upload')
+    config.crypto.chunk_size = case['chunk_size']
+    config.crypto.parallel_threshold = 0 if case['parallel'] else float('inf')
+    config.crypto.io_strategy = case['io_strategy']
+
+    from db_data.manager import db
+    from module.cipher_registry import get_cipher
+    from module.encrypt_apis import decrypt_file, decrypt_file_to_path, encrypt_file
+
+    get_cipher(case['algorithm']).use_backend(case['backend'])
+    size, payload = case['size'], case['payload']
+    if operation == 'decrypt_memory' and size > IN_MEMORY_LIMIT:
+        return None
+    output = case_dir / 'output.bin'
+    timings = []
+    rss_before = peak_rss_mb()
+
+    if operation == 'encrypt':
+        for index in range(case['repeat']):
+            start = time.perf_counter()
+            _, iv, blob_path, filled_password, _ = encrypt_file(
+                case['algorithm'], payload, 'bench', 'payload', PASSWORD, blob_format=case['blob_format']
+            )
+            timings.append(time.perf_counter() - start)
+            if index < case['repeat'] - 1:
+                os.remove(blob_path)
+        db.upload_file(filled_password, '', iv, 'bench', blob_path.as_posix(), case['algorithm'], size, 'payload', case['blob_format'])
+    else:
+        file_id = db.get_file_list({'user_name': 'bench'})[-1]['id']
+        for _ in range(case['repeat']):
+            start = time.perf_counter()
+            if operation == 'decrypt':
+                decrypt_file_to_path(case['algorithm'], PASSWORD, file_id, output)
+            else:
+                decrypt_file(case['algorithm'], PASSWORD, file_id)
+            timings.append(time.perf_counter() - start)
+        output.unlink(missing_ok=True)
+    db.close()
+
+    return {
+        'algorithm': case['algorithm'],
+        'backend': case['backend'],
+        'variant': case['variant'],
+        'chunk_size': case['chunk_size'],
+        'size': size,
+        'operation': operation,
+        'mbps': round(size / percentile(timings, 50) / 1024 / 1024, 2),
+        'p50_ms': round(percentile(timings, 50) * 1000, 3),
+        'p99_ms': round(percentile(timings, 99) * 1000, 3),
+        'peak_rss_mb': peak_rss_mb(),
+        'baseline_rss_mb': rss_before,
+    }
+
+
+def build_cases(args, work_dir: Path) -> list:
+    """生成所有测试组合"""
+    from module.cipher_registry import CIPHERS
+
+    algorithms = args.algorithms.split(',') if args.algorithms else list(CIPHERS)
+    variants = args.variants.split(',') if args.variants else list(VARIANTS)
+    cases = []
+    for size in map(parse_size, args.sizes.split(',')):
+        payload = generate_payload(work_dir, size)
+        for algorithm in algorithms:
+            backends = args.backends.split(',') if args.backends else list(CIPHERS[algorithm].backends)
+            for backend in backends:
+                if backend not in CIPHERS[algorithm].backends:
+                    continue
+                for variant in variants:
+                    blob_format, parallel, io_strategy = VARIANTS[variant]
+                    for chunk_size in map(parse_size, args.chunk_sizes.split(',')):
+                        cases.append(
+                            {
+                                'case_dir': str(work_dir / f'case_{len(cases)}'),
+                                'algorithm': algorithm,
+                                'backend': backend,
+                                'variant': variant,
+                                'blob_format': blob_format,
+                                'parallel': parallel,
+                                'io_strategy': io_strategy,
+                                'chunk_size': chunk_size,
+                                'size': size,
+                                'payload': str(payload),
+                                'repeat': args.repeat,
+                            }
+                        )
+    return cases
+
+
+def result_key(result: dict) -> tuple:
+    return tuple(result[key] for key in ('algorithm', 'backend', 'variant', 'chunk_size', 'size', 'operation'))
+
+
+def compare(results: list, baseline: list, tolerance: float) -> list:
+    """与基线对比, 吞吐量下降或p99耗时上升超过容差的记为性能回退"""
+    baseline_map = {result_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        base = baseline_map.get(result_key(result))
+        if not base:
+            continue
+        if result['mbps'] < base['mbps'] * (1 - tolerance) or result['p99_ms'] > base['p99_ms'] * (1 + tolerance):
+            regressions.append(
+                {
+                    'case': dict(zip(('algorithm', 'backend', 'variant', 'chunk_size', 'size', 'operation'), result_key(result))),
+                    'mbps': result['mbps'],
+                    'baseline_mbps': base['mbps'],
+                    'p99_ms': result['p99_ms'],
+                    'baseline_p99_ms': base['p99_ms'],
+                }
+            )
+    return regressions
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="加密吞吐量基准测试")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help="文件大小列表, 如 1K,1M,4G")
+    parser.add_argument('--chunk-sizes', default=DEFAULT_CHUNK_SIZES, help="流式分块大小列表, 如 64K,1M,8M")
+    parser.add_argument('--algorithms', default='', help="算法列表, 默认全部已注册算法")
+    parser.add_argument('--backends', default='', help="后端列表, 默认每个算法的全部后端")
+    parser.add_argument('--variants', default='', help=f"密文格式/并行方式/I/O方式, 可选 {','.join(VARIANTS)}")
+    parser.add_argument('--repeat', type=int, default=5, help="每个组合重复次数")
+    parser.add_argument('--output', default='', help="结果JSON输出路径, 默认输出到标准输出")
+    parser.add_argument('--baseline', default='', help="基线JSON路径, 指定时进行回退对比")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="回退容差, 默认10%%")
+    parser.add_argument('--work-dir', default='', help="临时文件目录, 默认系统临时目录")
+    args = parser.parse_args(argv)
+
+    work_dir = Path(tempfile.mkdtemp(prefix='sfg_bench_', dir=args.work_dir or None))
+    try:
+        results = []
+        for case in build_cases(args, work_dir):
+            # 每种操作使用全新的子进程, 保证峰值内存统计互不干扰, 解密的峰值不会被加密掩盖
+            for operation in OPERATIONS:
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                    result = executor.submit(run_case, case, operation).result()
+                if result:
+                    results.append(result)
+            shutil.rmtree(case['case_dir'], ignore_errors=True)
+            print(f"{case['algorithm']}/{case['backend']}/{case['variant']}/{format_size(case['size'])} 完成", file=sys.stderr)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        report['regressions'] = compare(results, baseline, args.tolerance)
+        exit_code = 1 if report['regressions'] else 0
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,9 @@
 # db/db_manager.py
+import base64
+import json
+import threading
 from contextlib import contextmanager
-from sqlite3 import IntegrityError, Row, connect
+from sqlite3 import IntegrityError, OperationalError, Row, complete_statement, connect
 from typing import Dict, List
 
 from module.common import get_password_hash
@@ -12,23 +15,113 @@ class DBManager(object):
 
     def __init__(self, db_path: str):
         self.db_path = db_path  # 读取数据库文件路径
+        self._local = threading.local()  # 每个线程一个长期使用的连接
         self._init_tables()
 
+    def _connect(self):
+        """新建连接并设置参数, 每个线程只执行一次"""
+        options = config.database
+        conn = connect(self.db_path, timeout=options.busy_timeout / 1000)
+        conn.row_factory = Row  # 支持字典式访问
+        conn.execute('PRAGMA journal_mode=WAL')  # 读写互不阻塞
+        conn.execute('PRAGMA synchronous=NORMAL')  # WAL 模式下只在检查点时 fsync, 需要立即落盘的提交使用 _get_durable_connection
+        conn.execute(f'PRAGMA cache_size={-options.cache_size}')  # 负数表示以KB为单位
+        conn.execute(f'PRAGMA mmap_size={options.mmap_size}')
+        conn.execute(f'PRAGMA busy_timeout={options.busy_timeout}')
+        return conn
+
     @contextmanager
     def _get_connection(self):
-        """连接数据库"""
-        conn = connect(self.db_path)
-        conn.row_factory = Row  # 支持字典式访问
+        """获取当前线程的数据库连接, 连接在线程内复用, 线程结束时释放; 退出时回滚没有提交的修改, 与每次关闭连接的行为一致"""
+        local = self._local
+        if getattr(local, 'conn', None) is None:
+            local.conn = self._connect()
+            local.depth = 0
+        local.depth += 1
         try:
-            yield conn
+            yield local.conn
         finally:
+            local.depth -= 1
+            if local.depth == 0 and local.conn.in_transaction:
+                local.conn.rollback()
+
+    @contextmanager
+    def _get_durable_connection(self):
+        """
+        获取当前线程的数据库连接, 期间的提交在返回前 fsync 到 WAL 文件, 不能在未提交的事务中调用.
+        synchronous=NORMAL 时掉电可能丢失最近的提交, 提交后会删除旧密文的操作(重新加密、迁移布局、平衡上传目录、整理 pack)
+        使用此连接, 避免掉电后记录回到旧路径而旧密文已被删除; WAL 按顺序写入, 之前的提交也一并落盘
+        """
+        with self._get_connection() as conn:
+            conn.execute('PRAGMA synchronous=FULL')
+            try:
+                yield conn
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+                conn.execute('PRAGMA synchronous=NORMAL')
+
+    def close(self):
+        """关闭当前线程的数据库连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
             conn.close()
 
     def _init_tables(self):
-        """初始化表格"""
+        """初始化表格: 执行未完成的数据库迁移, 已是最新版本时不执行任何建表语句"""
         with self._get_connection() as conn:
-            # 执行初始化表格sql语句L
-            conn.executescript(SQL_CREATE_TABLES)
+            self._migrate(conn)
+            self.fts_enabled = self._init_fts(conn)
+
+    @staticmethod
+    def _migrate(conn):
+        """按版本号顺序执行 MIGRATIONS 中高于 PRAGMA user_version 的迁移, 每个迁移和新的版本号在同一个事务中提交"""
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        for target, description, migration in MIGRATIONS:
+            if target <= version:
+                continue
+            conn.execute('BEGIN IMMEDIATE')  # 多个进程同时启动时只有一个执行迁移
+            try:
+                # 获得写锁后重新读取版本号, 其他进程可能已经完成了迁移
+                if conn.execute('PRAGMA user_version').fetchone()[0] >= target:
+                    conn.rollback()
+                    continue
+                if callable(migration):
+                    migration(conn)
+                else:
+                    for statement in _split_sql(migration):
+                        conn.execute(statement)
+                conn.execute(f'PRAGMA user_version={target}')
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            print(f"数据库迁移到版本{target}: {description}")
+
+    @staticmethod
+    def _init_fts(conn) -> bool:
+        """
+        创建全文检索表和同步触发器, 当前 SQLite 不支持 FTS5 或 trigram 分词时返回 False, 搜索退回 LIKE
+        是否可用取决于运行时的 SQLite, 不作为数据库迁移, 已创建时只检查一次能否读取
+        """
+        names = "'sfg_file_fts', 'sfg_user_fts'," + ','.join(f"'{table}_fts_{event}'" for table in ('sfg_file', 'sfg_user') for event in ('insert', 'delete', 'update'))
+        created = conn.execute(f'SELECT COUNT(*) FROM sqlite_master WHERE name IN ({names})').fetchone()[0] == 8
+        try:
+            if created:
+                conn.execute('SELECT 1 FROM sfg_file_fts LIMIT 0')
+                return True
+            conn.executescript(SQL_CREATE_FTS)
+        except OperationalError as e:
+            # 删除可能由支持 FTS5 的版本创建的触发器, 否则写入文件和用户时会因找不到 fts5 模块而失败
+            conn.executescript(SQL_DROP_FTS_TRIGGERS)
+            print(f"全文检索不可用, 搜索使用 LIKE: {e}")
+            return False
+        # 新建或触发器缺失期间原表有修改, 按原表重建索引
+        conn.execute("INSERT INTO sfg_file_fts(sfg_file_fts) VALUES ('rebuild')")
+        conn.execute("INSERT INTO sfg_user_fts(sfg_user_fts) VALUES ('rebuild')")
+        conn.commit()
+        return True
 
     def init_amdin_user(self) -> dict:
         """初始化管理员用户, 查找是否有admin用户, 没有则新建admin用户"""
@@ -53,25 +146,110 @@ class DBManager(object):
         with self._get_connection() as conn:
             """拼接sql语句适配各种参数"""
             sql_str = """SELECT * FROM sfg_user """
-            sql_values = []
-            if params:
-                sql_keys = []
-                for key, value in params.items():
-                    sql_keys.append(f'"{key}"=?')
-                    sql_values.append(value)
-                sql_str += 'WHERE ' + ' and '.join(sql_keys)
-            if query:
-                if params:
-                    sql_str += f" AND "
-                else:
-                    sql_str += f" WHERE "
-                sql_str += f"(username LIKE ? OR phone LIKE ? OR email LIKE ?)"
-                sql_values.extend([f'%{query}%'] * 3)
+            conditions, sql_values, _ = self._build_filter(params, query, USER_SEARCH)
+            if conditions:
+                sql_str += 'WHERE ' + ' AND '.join(conditions)
             sql_str += ' ORDER BY username'  # 根据用户名排序
             cursor = conn.execute(sql_str, sql_values)
             rows = cursor.fetchall()
             return rows and [dict(user_obj) for user_obj in rows]
 
+    def get_user_page(
+        self, params: dict, query: str = '', page_size: int = None, sort: str = 'username', direction: str = 'asc', cursor: str = None, with_total: bool = False
+    ) -> Dict:
+        """
+        分页查询用户信息列表
+        :param params: 等值查询条件
+        :param query: 搜索用户名、手机号或邮箱, 空格分隔的多个关键词需要同时匹配
+        :param page_size: 每页条数, 默认 database.page_size
+        :param sort: 排序字段, 见 USER_SORT_COLUMNS; rank 表示按搜索相关度排序
+        :param direction: asc 或 desc
+        :param cursor: 上一页返回的 next_cursor, 为空表示第一页
+        :param with_total: 是否统计总条数
+        :return: 见 _get_page
+        """
+        return self._get_page(USER_SEARCH, 'username', USER_SORT_COLUMNS, params, query, page_size, sort, direction, cursor, with_total)
+
+    def _build_filter(self, params: dict, query: str, search: tuple, match: bool = True) -> tuple:
+        """
+        根据等值条件和搜索关键词拼接查询条件
+        关键词按空格拆分, 每个关键词匹配任意一个搜索字段即可. 支持全文检索时, 不少于3个字的关键词在 trigram 索引中匹配,
+        更短的关键词无法使用 trigram 索引, 在全文检索的结果中用 LIKE 过滤
+        :param search: 见 FILE_SEARCH
+        :param match: 为 False 时不添加全文检索条件, 由调用方连接全文检索表
+        :return: (条件列表, 参数列表, 全文检索表达式), 没有需要全文检索的关键词时表达式为 None
+        """
+        table, fts_table, rowid, search_columns = search
+        conditions, sql_values = [], []
+        for key, value in (params or {}).items():
+            conditions.append(f'{table}."{key}"=?')
+            sql_values.append(value)
+        terms = query.split() if query else []
+        expression = None
+        if self.fts_enabled:
+            # 关键词作为短语匹配, 双引号转义后不会被解析为 FTS5 语法
+            expression = ' AND '.join('"' + term.replace('"', '""') + '"' for term in terms if len(term) >= 3) or None
+            terms = [term for term in terms if len(term) < 3]
+        if expression and match:
+            conditions.append(f'{table}.{rowid} IN (SELECT rowid FROM {fts_table} WHERE {fts_table} MATCH ?)')
+            sql_values.append(expression)
+        for term in terms:
+            conditions.append('(' + ' OR '.join(f'{table}.{column} LIKE ?' for column in search_columns) + ')')
+            sql_values.extend([f'%{term}%'] * len(search_columns))
+        return conditions, sql_values, expression
+
+    def _get_page(
+        self, search: tuple, key: str, sort_columns: tuple, params: dict, query: str, page_size: int, sort: str, direction: str, cursor: str, with_total: bool
+    ) -> Dict:
+        """
+        键集分页: 按 (排序字段, 主键) 排序, 从游标记录的上一页最后一行之后继续读取, 不使用 OFFSET, 每页的代价只与页大小有关
+        :param search: 见 FILE_SEARCH
+        :param key: 主键, 排序字段相同时按主键排序, 保证顺序唯一
+        :param sort_columns: 允许排序的字段, 必须非空且有索引
+        :param sort: 排序字段, rank 表示按全文检索的相关度(bm25)排序, 没有可全文检索的关键词时按 sort_columns 的第一个字段排序
+        :return: rows 为本页数据, next_cursor 为下一页游标(没有下一页时为 None),
+                 with_total 时 total 为总条数, 超过 database.count_limit 时只统计到该值, 此时 total_exact 为 False
+        """
+        if sort not in sort_columns and sort != 'rank':
+            raise ValueError(f"不支持按{sort}排序, 可选: {', '.join(sort_columns)}, rank")
+        if direction not in ('asc', 'desc'):
+            raise ValueError(f"排序方向只能是 asc 或 desc: {direction}")
+        page_size = page_size or config.database.page_size
+        table, fts_table, rowid, _ = search
+        conditions, sql_values, expression = self._build_filter(params, query, search, match=sort != 'rank')
+        if sort == 'rank' and expression:
+            # 连接全文检索表取得相关度, (排序字段SQL, 结果中的字段名)
+            sql_str = f"SELECT {table}.*, {fts_table}.rank AS search_rank FROM {table} JOIN {fts_table} ON {fts_table}.rowid = {table}.{rowid} "
+            page_conditions, page_values = [f'{fts_table} MATCH ?', *conditions], [expression, *sql_values]
+            order = [(f'{fts_table}.rank', 'search_rank'), (f'{table}.{key}', key)]
+        else:
+            sort_column = sort_columns[0] if sort == 'rank' else sort
+            sql_str = f"SELECT * FROM {table} "
+            page_conditions, page_values = list(conditions), list(sql_values)
+            order = [(f'{table}.{column}', column) for column in ([sort_column] if sort_column == key else [sort_column, key])]
+        if cursor:
+            # 行值比较可以直接使用 (排序字段, 主键) 上的索引定位到上一页最后一行
+            page_conditions.append(f"({', '.join(column for column, _ in order)}) {'>' if direction == 'asc' else '<'} ({', '.join('?' * len(order))})")
+            page_values.extend(_decode_cursor(cursor, sort, direction))
+        if page_conditions:
+            sql_str += 'WHERE ' + ' AND '.join(page_conditions)
+        sql_str += ' ORDER BY ' + ', '.join(f'{column} {direction.upper()}' for column, _ in order) + ' LIMIT ?'
+        with self._get_connection() as conn:
+            rows = [dict(row) for row in conn.execute(sql_str, [*page_values, page_size + 1])]  # 多读一行判断是否有下一页
+            page = {'rows': rows[:page_size], 'next_cursor': None, 'total': None, 'total_exact': True}
+            if len(rows) > page_size:
+                page['next_cursor'] = _encode_cursor(sort, direction, [rows[page_size - 1][name] for _, name in order])
+            if with_total:
+                conditions, sql_values, _ = self._build_filter(params, query, search)
+                count_limit = config.database.count_limit
+                count_str = f"SELECT COUNT(*) FROM (SELECT 1 FROM {table} "
+                if conditions:
+                    count_str += 'WHERE ' + ' AND '.join(conditions)
+                count_str += ' LIMIT ?)'
+                total = conn.execute(count_str, [*sql_values, count_limit + 1]).fetchone()[0]
+                page['total'], page['total_exact'] = min(total, count_limit), total <= count_limit
+        return page
+
     # 用户操作示例
     def create_user(self, user_data: Dict) -> bool:
         """创建用户"""
@@ -159,13 +337,30 @@ class DBManager(object):
             conn.commit()
 
     # 上传文件
-    def upload_file(self, password, password_hash, iv, username, file_path, algorithm, file_size, file_name) -> bool:
+    def upload_file(
+        self,
+        password,
+        password_hash,
+        iv,
+        username,
+        file_path,
+        algorithm,
+        file_size,
+        file_name,
+        blob_format='cbc',
+        compression='none',
+        wrapped_key=None,
+        blob_digest=None,
+        pack_location=None,
+        blob_root=None,
+    ) -> bool:
         """上传用户"""
+        pack_segment, pack_offset, pack_length = pack_location or (None, None, None)
         with self._get_connection() as conn:
             try:
                 conn.execute(
-                    '''INSERT INTO sfg_encrypted_file (password, password_hash, iv, user_name, file_path, algorithm, file_size, file_name) VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
-                    (password, password_hash, iv, username, file_path, algorithm, file_size, file_name),
+                    '''INSERT INTO sfg_encrypted_file (password, password_hash, iv, user_name, file_path, algorithm, file_size, file_name, blob_format, compression, wrapped_key, blob_digest, pack_segment, pack_offset, pack_length, blob_root) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                    (password, password_hash, iv, username, file_path, algorithm, file_size, file_name, blob_format, compression, wrapped_key, blob_digest, pack_segment, pack_offset, pack_length, blob_root),
                 )
                 conn.commit()
                 print(f"用户{username} 上传文件 {file_name} 成功")
@@ -173,21 +368,370 @@ class DBManager(object):
             except IntegrityError:
                 return False
 
-    def edit_file(self, file_id, password, password_hash, iv, algorithm, file_name) -> bool:
-        # 编辑用户信息
+    def upload_files_bulk(self, records: list, batch_size: int = None) -> list:
+        """
+        批量上传文件, 每批在一个事务中插入并提交一次, 避免逐条提交的同步开销
+        :param records: 文件记录列表, 字段与 upload_file 的参数相同
+        :param batch_size: 每个事务插入的条数, 默认 database.bulk_batch
+        :return: 与 records 顺序一致的新文件id, 某一批插入失败时该批回滚, 只返回之前已提交的id
+        """
+        batch_size = batch_size or config.database.bulk_batch
+        file_ids = []
         with self._get_connection() as conn:
+            for start in range(0, len(records), batch_size):
+                batch = records[start : start + batch_size]
+                rows = []
+                for record in batch:
+                    pack_segment, pack_offset, pack_length = record.get('pack_location') or (None, None, None)
+                    rows.append(
+                        (
+                            record['password'],
+                            record['password_hash'],
+                            record['iv'],
+                            record['username'],
+                            record['file_path'],
+                            record['algorithm'],
+                            record['file_size'],
+                            record['file_name'],
+                            record.get('blob_format', 'cbc'),
+                            record.get('compression', 'none'),
+                            record.get('wrapped_key'),
+                            record.get('blob_digest'),
+                            pack_segment,
+                            pack_offset,
+                            pack_length,
+                            record.get('blob_root'),
+                        )
+                    )
+                try:
+                    conn.executemany(
+                        '''INSERT INTO sfg_encrypted_file (password, password_hash, iv, user_name, file_path, algorithm, file_size, file_name, blob_format, compression, wrapped_key, blob_digest, pack_segment, pack_offset, pack_length, blob_root) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                        rows,
+                    )
+                    # 事务持有写锁, 同一批的自增id连续, 由最后一条的id倒推(触发器中的插入不影响 last_insert_rowid)
+                    last_id = conn.execute('''SELECT last_insert_rowid()''').fetchone()[0]
+                    conn.commit()
+                except IntegrityError as e:
+                    conn.rollback()
+                    print(f"批量上传文件失败: {e}")
+                    break
+                file_ids.extend(range(last_id - len(batch) + 1, last_id + 1))
+            print(f"批量上传文件 {len(file_ids)}/{len(records)} 个成功")
+        return file_ids
+
+    def edit_file(
+        self,
+        file_id,
+        password,
+        password_hash,
+        iv,
+        algorithm,
+        file_name,
+        file_path,
+        blob_format='cbc',
+        compression='none',
+        wrapped_key=None,
+        blob_digest=None,
+        pack_location=None,
+        blob_root=None,
+        expected: dict = None,
+    ) -> bool:
+        """
+        编辑文件信息
+        :param expected: 更新的前提条件 {列名: 读取时的值}, 记录已被其他操作修改时不更新
+        :return: 是否更新了记录
+        """
+        pack_segment, pack_offset, pack_length = pack_location or (None, None, None)
+        conditions = ''.join(f' AND "{key}" IS ?' for key in (expected or {}))
+        with self._get_durable_connection() as conn:
             try:
-                conn.execute(
-                    f'''update sfg_encrypted_file set  password=?, password_hash=?, iv=?, algorithm=?, file_name=?, modified_at=CURRENT_TIMESTAMP where id=?''',
-                    (password, password_hash, iv, algorithm, file_name, file_id),
+                cursor = conn.execute(
+                    f'''update sfg_encrypted_file set  password=?, password_hash=?, iv=?, algorithm=?, file_name=?, file_path=?, blob_format=?, compression=?, wrapped_key=?, blob_digest=?, pack_segment=?, pack_offset=?, pack_length=?, blob_root=?, modified_at=CURRENT_TIMESTAMP where id=?{conditions}''',
+                    (password, password_hash, iv, algorithm, file_name, file_path, blob_format, compression, wrapped_key, blob_digest, pack_segment, pack_offset, pack_length, blob_root, file_id, *(expected or {}).values()),
                 )
                 conn.commit()
+                if not cursor.rowcount:
+                    print(f"文件 {file_name} 已被修改, 未更新")
+                    return False
                 print(f"更新文件 {file_name} 成功")
                 return True
             except IntegrityError:
                 return False
 
-    # 查找单个文件
+    def update_file_info(self, file_id: int, params: dict, expected: dict = None) -> bool:
+        """
+        只更新文件元数据(文件名、描述等), 不涉及密文
+        :param expected: 更新的前提条件 {列名: 读取时的值}, 记录已被其他操作修改时不更新
+        :return: 是否更新了记录
+        """
+        sql_str = """update sfg_encrypted_file set """
+        if not params:
+            return
+        sql_keys = []
+        sql_values = []
+        for key, value in params.items():
+            sql_keys.append(f'"{key}"=?')
+            sql_values.append(value)
+        sql_str += ' , '.join(sql_keys)
+        sql_values.append(file_id)
+        conditions = ''.join(f' AND "{key}" IS ?' for key in (expected or {}))
+        sql_values.extend((expected or {}).values())
+        with self._get_connection() as conn:
+            try:
+                cursor = conn.execute(f'''{sql_str}, modified_at=CURRENT_TIMESTAMP WHERE id = ?{conditions}''', sql_values)
+                conn.commit()
+                if not cursor.rowcount:
+                    print(f"文件{file_id} 已被修改, 未更新")
+                    return False
+                print(f"文件{file_id} 更新成功")
+                return True
+            except IntegrityError:
+                return False
+
+    def update_file_keys(self, updates: list) -> list:
+        """批量更新文件密码和包装后的数据密钥, 在一个事务中提交
+        只更新密文路径和数据密钥与读取时一致的记录, 期间被重新加密或修改过密码的文件不更新, 否则新密钥包装的是旧的数据密钥
+        :param updates: [(password, password_hash, wrapped_key, file_id, 读取时的 file_path, 读取时的 wrapped_key, 读取时的 password), ...]
+        :return: 更新成功的文件id
+        """
+        updated = []
+        with self._get_connection() as conn:
+            try:
+                for password, password_hash, wrapped_key, file_id, old_path, old_wrapped_key, old_password in updates:
+                    cursor = conn.execute(
+                        '''update sfg_encrypted_file set password=?, password_hash=?, wrapped_key=?, modified_at=CURRENT_TIMESTAMP
+                        where id=? AND file_path=? AND wrapped_key IS ? AND password=?''',
+                        (password, password_hash, wrapped_key, file_id, old_path, old_wrapped_key, old_password),
+                    )
+                    if cursor.rowcount:
+                        updated.append(file_id)
+                conn.commit()
+                print(f"{len(updated)}/{len(updates)}个文件 更新密钥成功")
+                return updated
+            except IntegrityError:
+                return []
+
+    # 批量重新加密任务
+    def create_rekey_job(self, target_algorithm: str, source_algorithms: list = None, user_name: str = None) -> int:
+        """创建重新加密任务, 选中 原算法/用户 匹配且不是目标算法的文件, 返回任务id"""
+        sql_keys = ['algorithm != ?']
+        sql_values = [target_algorithm]
+        if source_algorithms:
+            sql_keys.append(f"algorithm IN ({', '.join('?' * len(source_algorithms))})")
+            sql_values.extend(source_algorithms)
+        if user_name:
+            sql_keys.append('user_name = ?')
+            sql_values.append(user_name)
+        with self._get_connection() as conn:
+            cursor = conn.execute(
+                '''INSERT INTO sfg_rekey_job (target_algorithm, source_algorithms, user_name) VALUES (?, ?, ?)''',
+                (target_algorithm, source_algorithms and ','.join(source_algorithms), user_name),
+            )
+            job_id = cursor.lastrowid
+            conn.execute(
+                f'''INSERT INTO sfg_rekey_item (job_id, file_id, file_size) SELECT ?, id, file_size FROM sfg_encrypted_file WHERE {' AND '.join(sql_keys)}''',
+                [job_id, *sql_values],
+            )
+            conn.commit()
+            print(f"重新加密任务{job_id} 创建成功")
+            return job_id
+
+    def get_rekey_job(self, job_id: int) -> dict | None:
+        """查询重新加密任务, 附带各状态的文件数和字节数"""
+        with self._get_connection() as conn:
+            job = conn.execute('''SELECT * FROM sfg_rekey_job WHERE id=?''', (job_id,)).fetchone()
+            if not job:
+                return None
+            job = dict(job)
+            rows = conn.execute(
+                '''SELECT status, COUNT(*) AS files, COALESCE(SUM(file_size), 0) AS bytes FROM sfg_rekey_item WHERE job_id=? GROUP BY status''',
+                (job_id,),
+            )
+            job['items'] = {row['status']: {'files': row['files'], 'bytes': row['bytes']} for row in rows}
+            return job
+
+    def get_rekey_items(self, job_id: int, status: str = 'pending') -> List[Dict]:
+        """查询任务中指定状态的文件"""
+        with self._get_connection() as conn:
+            rows = conn.execute('''SELECT * FROM sfg_rekey_item WHERE job_id=? AND status=? ORDER BY file_id''', (job_id, status)).fetchall()
+            return [dict(row) for row in rows]
+
+    def start_rekey_job(self, job_id: int):
+        """开始(或继续)任务, 上次中断时正在处理的文件重新处理"""
+        with self._get_connection() as conn:
+            conn.execute('''UPDATE sfg_rekey_item SET status='pending' WHERE job_id=? AND status='running' ''', (job_id,))
+            conn.execute('''UPDATE sfg_rekey_job SET status='running', modified_at=CURRENT_TIMESTAMP WHERE id=?''', (job_id,))
+            conn.commit()
+            print(f"重新加密任务{job_id} 开始")
+
+    def update_rekey_item(self, job_id: int, file_id: int, status: str, error: str = None, elapsed: float = None):
+        """更新任务中单个文件的状态, 同时记录任务累计运行时间"""
+        with self._get_connection() as conn:
+            conn.execute('''UPDATE sfg_rekey_item SET status=?, error=? WHERE job_id=? AND file_id=?''', (status, error, job_id, file_id))
+            if elapsed is not None:
+                conn.execute('''UPDATE sfg_rekey_job SET elapsed=?, modified_at=CURRENT_TIMESTAMP WHERE id=?''', (elapsed, job_id))
+            conn.commit()
+
+    def finish_rekey_job(self, job_id: int, status: str, elapsed: float):
+        """结束本次运行, status 为 done(全部处理完) 或 paused(被中止, 可继续)"""
+        with self._get_connection() as conn:
+            conn.execute('''UPDATE sfg_rekey_job SET status=?, elapsed=?, modified_at=CURRENT_TIMESTAMP WHERE id=?''', (status, elapsed, job_id))
+            conn.commit()
+            print(f"重新加密任务{job_id} {status}")
+
+    # 后台校验
+    def get_scrub_state(self) -> dict:
+        """查询后台校验进度, 没有记录时从头开始"""
+        with self._get_connection() as conn:
+            state = conn.execute('''SELECT * FROM sfg_scrub_state WHERE id=1''').fetchone()
+            return dict(state) if state else {'id': 1, 'cursor': 0, 'rounds': 0, 'modified_at': None}
+
+    def set_scrub_cursor(self, cursor: int, finish_round: bool = False):
+        """记录已校验到的文件id, finish_round 为 True 时表示完成一轮, 游标回到开头"""
+        with self._get_connection() as conn:
+            conn.execute(
+                '''INSERT INTO sfg_scrub_state (id, cursor, rounds, modified_at) VALUES (1, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(id) DO UPDATE SET cursor=excluded.cursor, rounds=rounds + excluded.rounds, modified_at=excluded.modified_at''',
+                (cursor, int(finish_round)),
+            )
+            conn.commit()
+
+    def get_files_after(self, file_id: int, limit: int) -> List[Dict]:
+        """按id顺序查询 file_id 之后的文件"""
+        with self._get_connection() as conn:
+            rows = conn.execute(
+                '''SELECT id, file_path, blob_digest, user_name, file_name, pack_segment, pack_offset, pack_length, blob_root FROM sfg_encrypted_file WHERE id > ? ORDER BY id LIMIT ?''', (file_id, limit)
+            ).fetchall()
+            return [dict(row) for row in rows]
+
+    def update_blob_faults(self, results: list):
+        """
+        记录校验结果, 损坏或丢失的文件写入 sfg_blob_fault, 校验通过的文件移除之前的记录
+        :param results: [(文件id, 密文路径, 状态), ...]
+        """
+        faults = [(file_id, file_path, status) for file_id, file_path, status in results if status in ('corrupt', 'missing')]
+        with self._get_connection() as conn:
+            conn.executemany(
+                '''INSERT INTO sfg_blob_fault (file_id, file_path, status) VALUES (?, ?, ?)
+                ON CONFLICT(file_id) DO UPDATE SET file_path=excluded.file_path, status=excluded.status, checked_at=CURRENT_TIMESTAMP''',
+                faults,
+            )
+            conn.executemany(
+                '''DELETE FROM sfg_blob_fault WHERE file_id=?''', [(file_id,) for file_id, _, status in results if status == 'ok']
+            )
+            conn.commit()
+
+    def get_blob_faults(self) -> List[Dict]:
+        """查询损坏或丢失的密文, 附带文件名和上传用户"""
+        with self._get_connection() as conn:
+            rows = conn.execute(
+                '''SELECT fault.*, file.file_name, file.user_name FROM sfg_blob_fault AS fault
+                LEFT JOIN sfg_encrypted_file AS file ON file.id = fault.file_id ORDER BY fault.file_id'''
+            ).fetchall()
+            return [dict(row) for row in rows]
+
+    def move_blob_paths(self, moves: list) -> list:
+        """
+        在一个事务中批量修改密文路径, 只修改路径没有变化的记录(迁移过程中被重新加密或删除的文件不修改)
+        :param moves: [(文件id, 原路径, 新路径, 新路径所在的上传目录), ...]
+        :return: 修改成功的文件id
+        """
+        moved = []
+        with self._get_durable_connection() as conn:
+            for file_id, old_path, new_path, blob_root in moves:
+                cursor = conn.execute(
+                    '''UPDATE sfg_encrypted_file SET file_path=?, blob_root=? WHERE id=? AND file_path=?''', (new_path, blob_root, file_id, old_path)
+                )
+                if cursor.rowcount:
+                    moved.append(file_id)
+            conn.commit()
+            return moved
+
+    def get_root_files(self, blob_root: str, default_root: str, limit: int) -> List[Dict]:
+        """
+        查询上传目录中的文件, 从大到小排列
+        :param blob_root: 上传目录
+        :param default_root: 没有记录上传目录的旧文件所在的目录
+        """
+        with self._get_connection() as conn:
+            # 不在 blob_root 列上使用函数, 以便使用 (blob_root, file_size) 索引
+            condition = '(blob_root=? OR blob_root IS NULL)' if blob_root == default_root else 'blob_root=?'
+            rows = conn.execute(
+                f'''SELECT id, file_path, file_size, user_name, file_name, blob_digest, blob_root FROM sfg_encrypted_file
+                WHERE pack_segment IS NULL AND {condition} ORDER BY file_size DESC LIMIT ?''',
+                (blob_root, limit),
+            ).fetchall()
+            return [dict(row) for row in rows]
+
+    def get_blob_paths(self) -> set:
+        """查询数据库中引用的全部密文路径"""
+        with self._get_connection() as conn:
+            return {row['file_path'] for row in conn.execute('''SELECT file_path FROM sfg_encrypted_file''')}
+
+    # pack 文件
+    def get_active_pack_segment(self) -> dict | None:
+        """查询当前追加写入的 pack 文件"""
+        with self._get_connection() as conn:
+            segment = conn.execute('''SELECT * FROM sfg_pack_segment WHERE sealed=0 ORDER BY id DESC LIMIT 1''').fetchone()
+            return segment and dict(segment)
+
+    def create_pack_segment(self, file_path: str) -> int:
+        """登记新的 pack 文件, 返回id"""
+        with self._get_connection() as conn:
+            cursor = conn.execute('''INSERT INTO sfg_pack_segment (file_path) VALUES (?)''', (file_path,))
+            conn.commit()
+            return cursor.lastrowid
+
+    def seal_pack_segment(self, segment_id: int):
+        """pack 文件写满后不再追加"""
+        with self._get_connection() as conn:
+            conn.execute('''UPDATE sfg_pack_segment SET sealed=1 WHERE id=?''', (segment_id,))
+            conn.commit()
+
+    def get_pack_segments(self) -> List[Dict]:
+        """查询所有 pack 文件及其中仍被引用的文件数和字节数"""
+        with self._get_connection() as conn:
+            rows = conn.execute(
+                '''SELECT segment.*, COUNT(file.id) AS live_files, COALESCE(SUM(file.pack_length), 0) AS live_bytes
+                FROM sfg_pack_segment AS segment LEFT JOIN sfg_encrypted_file AS file ON file.pack_segment = segment.id
+                GROUP BY segment.id ORDER BY segment.id'''
+            ).fetchall()
+            return [dict(row) for row in rows]
+
+    def get_packed_files(self, segment_id: int) -> List[Dict]:
+        """查询 pack 文件中仍被引用的文件"""
+        with self._get_connection() as conn:
+            rows = conn.execute(
+                '''SELECT id, file_path, pack_segment, pack_offset, pack_length FROM sfg_encrypted_file WHERE pack_segment=? ORDER BY pack_offset''',
+                (segment_id,),
+            ).fetchall()
+            return [dict(row) for row in rows]
+
+    def move_packed_file(self, file_dict: dict, file_path: str, pack_location: tuple) -> bool:
+        """
+        整理 pack 文件时修改文件位置, 只修改位置没有变化的记录(整理过程中被重新加密或删除的文件不修改)
+        :param file_dict: 整理前的文件记录
+        :param file_path: 新的 pack 文件路径
+        :param pack_location: 新的 (pack文件id, 偏移量, 长度)
+        """
+        with self._get_connection() as conn:
+            cursor = conn.execute(
+                '''UPDATE sfg_encrypted_file SET file_path=?, pack_segment=?, pack_offset=?, pack_length=? WHERE id=? AND pack_segment=? AND pack_offset=?''',
+                (file_path, *pack_location, file_dict['id'], file_dict['pack_segment'], file_dict['pack_offset']),
+            )
+            conn.commit()
+            return cursor.rowcount > 0
+
+    def delete_pack_segment(self, segment_id: int) -> bool:
+        """删除已没有文件引用的 pack 文件记录"""
+        with self._get_durable_connection() as conn:
+            cursor = conn.execute(
+                '''DELETE FROM sfg_pack_segment WHERE id=? AND NOT EXISTS (SELECT 1 FROM sfg_encrypted_file WHERE pack_segment=?)''',
+                (segment_id, segment_id),
+            )
+            conn.commit()
+            return cursor.rowcount > 0
+
     def get_file_by_id(self, file_id: int) -> dict | None:
         with self._get_connection() as conn:
             try:
@@ -201,30 +745,36 @@ class DBManager(object):
     def get_file_list(self, params: dict = {}, query: str = '') -> List[Dict]:
         with self._get_connection() as conn:
             sql_str = """SELECT * FROM sfg_encrypted_file """
-            sql_values = []
-            if params:
-                sql_keys = []
-                for key, value in params.items():
-                    sql_keys.append(f'"{key}"=?')
-                    sql_values.append(value)
-                sql_str += 'WHERE ' + ' and '.join(sql_keys)
-            if query:
-                if params:
-                    sql_str += f" AND "
-                else:
-                    sql_str += f" WHERE "
-                sql_str += f"(file_name LIKE ? OR user_name LIKE ? OR algorithm LIKE ?)"
-                sql_values.extend([f'%{query}%'] * 3)
+            conditions, sql_values, _ = self._build_filter(params, query, FILE_SEARCH)
+            if conditions:
+                sql_str += 'WHERE ' + ' AND '.join(conditions)
             sql_str += ' ORDER BY file_name, algorithm '
             cursor = conn.execute(sql_str, sql_values)
             rows = cursor.fetchall()
             return rows and [dict(file_obj) for file_obj in rows]
 
+    def get_file_page(
+        self, params: dict = {}, query: str = '', page_size: int = None, sort: str = 'file_name', direction: str = 'asc', cursor: str = None, with_total: bool = False
+    ) -> Dict:
+        """
+        分页查询文件列表
+        :param params: 等值查询条件
+        :param query: 搜索文件名、上传用户或加密算法, 空格分隔的多个关键词需要同时匹配
+        :param page_size: 每页条数, 默认 database.page_size
+        :param sort: 排序字段, 见 FILE_SORT_COLUMNS; rank 表示按搜索相关度排序
+        :param direction: asc 或 desc
+        :param cursor: 上一页返回的 next_cursor, 为空表示第一页
+        :param with_total: 是否统计总条数
+        :return: 见 _get_page
+        """
+        return self._get_page(FILE_SEARCH, 'id', FILE_SORT_COLUMNS, params, query, page_size, sort, direction, cursor, with_total)
+
     def delete_file(self, file_id: int):
         """删除文件"""
         with self._get_connection() as conn:
             try:
                 conn.execute('''DELETE FROM sfg_encrypted_file WHERE id=? ''', (file_id,))
+                conn.execute('''DELETE FROM sfg_blob_fault WHERE file_id=? ''', (file_id,))
                 conn.commit()
                 print(f"文件删除成功")
                 return True
@@ -248,6 +798,7 @@ CREATE TABLE IF NOT EXISTS sfg_user (
 -- 用户表索引
 CREATE INDEX IF NOT EXISTS idx_user_role ON sfg_user(role);
 CREATE INDEX IF NOT EXISTS idx_user_lock ON sfg_user(is_locked);
+CREATE INDEX IF NOT EXISTS idx_user_created ON sfg_user(created_at);
 
 CREATE TABLE IF NOT EXISTS sfg_encrypted_file (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -263,12 +814,203 @@ CREATE TABLE IF NOT EXISTS sfg_encrypted_file (
     password_hash CHAR(32) NOT NULL,          -- 加密密码
     iv CHAR(32) NULL,                         -- 加密向量
     is_public BOOLEAN DEFAULT FALSE,          -- 是否公开
+    blob_format VARCHAR(16) DEFAULT 'cbc',    -- 密文格式(cbc: 整体CBC, segment: 分段可随机读取)
+    compression VARCHAR(16) DEFAULT 'none',   -- 加密前使用的压缩算法(none: 未压缩, zlib, lzma)
+    wrapped_key BLOB NULL,                    -- 用文件密码包装的数据密钥(信封加密), 为空时直接使用密码作为密钥
+    blob_digest CHAR(64) NULL,                -- 密文的 BLAKE2b 摘要(十六进制), 用于不解密校验完整性
+    pack_segment INTEGER NULL,                -- 小文件所在的 pack 文件id, 为空表示单独存储在 file_path
+    pack_offset BIGINT NULL,                  -- 密文在 pack 文件中的偏移量
+    pack_length BIGINT NULL,                  -- 密文长度
+    blob_root VARCHAR(255) NULL,              -- 密文所在的上传目录, 为空表示旧文件, 在 config.path.upload 中
     FOREIGN KEY (user_name) REFERENCES user(username)
 );
 -- 文件表索引
 CREATE INDEX IF NOT EXISTS idx_file_algorithm ON sfg_encrypted_file(algorithm);
 CREATE INDEX IF NOT EXISTS idx_file_user ON sfg_encrypted_file(user_name);
 CREATE INDEX IF NOT EXISTS idx_file_public ON sfg_encrypted_file(is_public);
+CREATE INDEX IF NOT EXISTS idx_file_name ON sfg_encrypted_file(file_name);
+CREATE INDEX IF NOT EXISTS idx_file_created ON sfg_encrypted_file(created_at);
+
+-- 批量重新加密任务, 任务创建时记录选中的文件, 中断后从未完成的文件继续
+CREATE TABLE IF NOT EXISTS sfg_rekey_job (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    target_algorithm VARCHAR(50) NOT NULL,    -- 目标加密算法
+    source_algorithms VARCHAR(255),           -- 选择的原加密算法(逗号分隔), 为空表示全部
+    user_name VARCHAR(50),                    -- 选择的用户, 为空表示全部
+    status VARCHAR(16) DEFAULT 'pending',     -- 任务状态(pending, running, paused, done)
+    elapsed REAL DEFAULT 0,                   -- 累计运行时间(秒)
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    modified_at DATETIME
+);
+CREATE TABLE IF NOT EXISTS sfg_rekey_item (
+    job_id INTEGER NOT NULL,
+    file_id INTEGER NOT NULL,
+    file_size BIGINT,                         -- 文件大小(字节), 用于统计吞吐量和预计剩余时间
+    status VARCHAR(16) DEFAULT 'pending',     -- 文件状态(pending, running, done, failed, skipped)
+    error TEXT,                               -- 失败原因
+    PRIMARY KEY (job_id, file_id)
+);
+
+-- 存放小文件密文的 pack 文件, 追加写入, 写满后封存, 删除的文件过多时由整理任务重写
+CREATE TABLE IF NOT EXISTS sfg_pack_segment (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    file_path TEXT NOT NULL,                  -- pack 文件路径
+    sealed BOOLEAN DEFAULT FALSE,             -- 是否已写满, 不再追加
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 后台校验进度, 只有一行, 重启后从上次的文件id之后继续
+CREATE TABLE IF NOT EXISTS sfg_scrub_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    cursor INTEGER DEFAULT 0,                 -- 已校验到的文件id
+    rounds INTEGER DEFAULT 0,                 -- 已完成的轮数
+    modified_at DATETIME
+);
+-- 后台校验发现的损坏或丢失的密文, 再次校验通过或文件删除后移除
+CREATE TABLE IF NOT EXISTS sfg_blob_fault (
+    file_id INTEGER PRIMARY KEY,
+    file_path TEXT,                           -- 校验时的密文路径
+    status VARCHAR(16) NOT NULL,              -- corrupt(摘要不一致) / missing(文件不存在)
+    detected_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    checked_at DATETIME DEFAULT CURRENT_TIMESTAMP  -- 最近一次校验时间
+);
 '''
 
+# 全文检索: 外部内容表, 只保存 trigram 索引, 由触发器与原表同步. trigram 分词支持任意位置的子串(包括前缀和完整词)匹配,
+# 中文文件名没有空格分词也能搜索, 与原来 LIKE '%关键词%' 的匹配结果一致
+SQL_CREATE_FTS = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS sfg_file_fts USING fts5(
+    file_name, user_name, algorithm, content='sfg_encrypted_file', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS sfg_file_fts_insert AFTER INSERT ON sfg_encrypted_file BEGIN
+    INSERT INTO sfg_file_fts(rowid, file_name, user_name, algorithm) VALUES (new.id, new.file_name, new.user_name, new.algorithm);
+END;
+CREATE TRIGGER IF NOT EXISTS sfg_file_fts_delete AFTER DELETE ON sfg_encrypted_file BEGIN
+    INSERT INTO sfg_file_fts(sfg_file_fts, rowid, file_name, user_name, algorithm) VALUES ('delete', old.id, old.file_name, old.user_name, old.algorithm);
+END;
+-- 只在搜索字段修改时更新索引, 修改密钥、路径等不受影响
+CREATE TRIGGER IF NOT EXISTS sfg_file_fts_update AFTER UPDATE OF file_name, user_name, algorithm ON sfg_encrypted_file BEGIN
+    INSERT INTO sfg_file_fts(sfg_file_fts, rowid, file_name, user_name, algorithm) VALUES ('delete', old.id, old.file_name, old.user_name, old.algorithm);
+    INSERT INTO sfg_file_fts(rowid, file_name, user_name, algorithm) VALUES (new.id, new.file_name, new.user_name, new.algorithm);
+END;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS sfg_user_fts USING fts5(
+    username, phone, email, content='sfg_user', content_rowid='rowid', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS sfg_user_fts_insert AFTER INSERT ON sfg_user BEGIN
+    INSERT INTO sfg_user_fts(rowid, username, phone, email) VALUES (new.rowid, new.username, new.phone, new.email);
+END;
+CREATE TRIGGER IF NOT EXISTS sfg_user_fts_delete AFTER DELETE ON sfg_user BEGIN
+    INSERT INTO sfg_user_fts(sfg_user_fts, rowid, username, phone, email) VALUES ('delete', old.rowid, old.username, old.phone, old.email);
+END;
+CREATE TRIGGER IF NOT EXISTS sfg_user_fts_update AFTER UPDATE OF username, phone, email ON sfg_user BEGIN
+    INSERT INTO sfg_user_fts(sfg_user_fts, rowid, username, phone, email) VALUES ('delete', old.rowid, old.username, old.phone, old.email);
+    INSERT INTO sfg_user_fts(rowid, username, phone, email) VALUES (new.rowid, new.username, new.phone, new.email);
+END;
+'''
+
+SQL_DROP_FTS_TRIGGERS = '''
+DROP TRIGGER IF EXISTS sfg_file_fts_insert;
+DROP TRIGGER IF EXISTS sfg_file_fts_delete;
+DROP TRIGGER IF EXISTS sfg_file_fts_update;
+DROP TRIGGER IF EXISTS sfg_user_fts_insert;
+DROP TRIGGER IF EXISTS sfg_user_fts_delete;
+DROP TRIGGER IF EXISTS sfg_user_fts_update;
+'''
+
+# 使用数据库迁移之前的版本需要补充的列: (表名, 列名, 列定义), 由迁移1补充
+SQL_ADD_COLUMNS = [
+    ('sfg_encrypted_file', 'blob_format', "VARCHAR(16) DEFAULT 'cbc'"),
+    ('sfg_encrypted_file', 'compression', "VARCHAR(16) DEFAULT 'none'"),
+    ('sfg_encrypted_file', 'wrapped_key', "BLOB NULL"),
+    ('sfg_encrypted_file', 'blob_digest', "CHAR(64) NULL"),
+    ('sfg_encrypted_file', 'pack_segment', "INTEGER NULL"),
+    ('sfg_encrypted_file', 'pack_offset', "BIGINT NULL"),
+    ('sfg_encrypted_file', 'pack_length', "BIGINT NULL"),
+    ('sfg_encrypted_file', 'blob_root', "VARCHAR(255) NULL"),
+]
+
+# 与查询的 WHERE 和 ORDER BY 一致的组合索引, 索引末尾隐含 rowid(即文件id)
+SQL_COMPOSITE_INDEXES = '''
+-- 普通用户的文件列表: WHERE user_name=? ORDER BY file_name, algorithm; 包含 idx_file_user
+CREATE INDEX IF NOT EXISTS idx_file_user_name ON sfg_encrypted_file(user_name, file_name, algorithm);
+DROP INDEX IF EXISTS idx_file_user;
+-- 普通用户的文件按上传时间分页
+CREATE INDEX IF NOT EXISTS idx_file_user_created ON sfg_encrypted_file(user_name, created_at);
+-- pack 文件中的密文按偏移量读取, 统计引用的字节数时只读索引
+CREATE INDEX IF NOT EXISTS idx_file_pack ON sfg_encrypted_file(pack_segment, pack_offset, pack_length);
+-- 平衡上传目录: WHERE blob_root=? ORDER BY file_size DESC
+CREATE INDEX IF NOT EXISTS idx_file_root ON sfg_encrypted_file(blob_root, file_size);
+-- 重新加密任务的待处理文件: WHERE job_id=? AND status=? ORDER BY file_id
+CREATE INDEX IF NOT EXISTS idx_rekey_item_status ON sfg_rekey_item(job_id, status, file_id);
+ANALYZE;
+'''
+
+# 键集分页按 (排序字段, 主键) 排序, 索引必须以主键结尾才能直接定位, 否则每页都要对同一排序值的行再排序(USE TEMP B-TREE)
+SQL_KEYSET_INDEXES = '''
+-- 普通用户的文件按文件名分页: WHERE user_name=? ORDER BY file_name, id; 不分页的列表按 algorithm 排序的只是同名文件
+CREATE INDEX IF NOT EXISTS idx_file_user_name_id ON sfg_encrypted_file(user_name, file_name, id);
+DROP INDEX IF EXISTS idx_file_user_name;
+-- 普通用户的文件按id分页: WHERE user_name=? ORDER BY id
+CREATE INDEX IF NOT EXISTS idx_file_user_id ON sfg_encrypted_file(user_name, id);
+-- 用户按注册时间分页: ORDER BY created_at, username, 用户表的主键 username 不是 rowid
+CREATE INDEX IF NOT EXISTS idx_user_created_name ON sfg_user(created_at, username);
+DROP INDEX IF EXISTS idx_user_created;
+ANALYZE;
+'''
+
+
+def _migrate_initial(conn):
+    """建表, 并为使用数据库迁移之前创建的数据库补充新增的列"""
+    for statement in _split_sql(SQL_CREATE_TABLES):
+        conn.execute(statement)
+    for table, column, definition in SQL_ADD_COLUMNS:
+        columns = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+        if column not in columns:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
+# 数据库迁移: (版本号, 说明, SQL 或接收连接的函数), 版本号递增, 已发布的迁移不能修改, 修改表结构时在末尾追加
+MIGRATIONS = [
+    (1, '初始表结构', _migrate_initial),
+    (2, '组合索引', SQL_COMPOSITE_INDEXES),
+    (3, '键集分页索引', SQL_KEYSET_INDEXES),
+]
+
+
+def _split_sql(script: str) -> list:
+    """把 SQL 脚本拆分为单条语句, executescript 会先提交当前事务, 迁移中不能使用"""
+    statements, statement = [], ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if complete_statement(statement):
+            statements.append(statement.strip())
+            statement = ''
+    return statements
+
+
+# 搜索配置: (表名, 全文检索表, 全文检索表 rowid 对应的列, 搜索字段)
+USER_SEARCH = ('sfg_user', 'sfg_user_fts', 'rowid', ('username', 'phone', 'email'))
+FILE_SEARCH = ('sfg_encrypted_file', 'sfg_file_fts', 'id', ('file_name', 'user_name', 'algorithm'))
+# 分页查询允许排序的字段, 均为非空且有索引的列(索引隐含 rowid, 即文件id)
+USER_SORT_COLUMNS = ('username', 'created_at')
+FILE_SORT_COLUMNS = ('file_name', 'created_at', 'id')
+
+
+def _encode_cursor(sort: str, direction: str, values: list) -> str:
+    """把上一页最后一行的排序字段值编码为游标, 调用方不需要关心其内容"""
+    data = json.dumps({'sort': sort, 'direction': direction, 'values': values}, ensure_ascii=False)
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def _decode_cursor(cursor: str, sort: str, direction: str) -> list:
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise ValueError("无效的分页游标")
+    if data.get('sort') != sort or data.get('direction') != direction:
+        raise ValueError("分页游标与排序方式不一致, 请从第一页重新查询")
+    return data['values']
+
+
 db = DBManager(config.path.db_file)
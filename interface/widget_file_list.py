@@ -19,7 +19,7 @@ from PySide6.QtWidgets import (
 )
 
 from interface.custom_widget import MyQLabelTip
-from module.file_apis import delete_file, download_file, get_file_list, varify_file_password
+from module.file_apis import delete_file, download_file, get_file_page, varify_file_password
 from setting.config_loader import config
 from setting.global_variant import DELIMITER, gcache
 
@@ -131,24 +131,45 @@ def _build_file_list_table(main_window: QMainWindow, container: QWidget):
     )
     container.table.setRowHeight(0, 48)  # 设置行高
     container.table.setFixedHeight(400)
+    # 加载下一页按钮, 没有下一页时隐藏
+    container.more_btn = QPushButton("加载更多")
+    container.more_btn.setStyleSheet(
+        """
+        QPushButton {
+            background: #409EFF44;
+            color: white;
+            padding: 8px 16px;
+            border-radius: 4px;
+            border: none;
+        }
+        QPushButton:hover { background: #66b1ff; }
+    """
+    )
+    container.more_btn.clicked.connect(lambda: load_table_data(container, container.query, container.next_cursor))
     load_table_data(container)
 
     # 组装布局
     container.layout().addSpacing(20)
     container.layout().addLayout(search_layout)
     container.layout().addWidget(container.table)
+    container.layout().addWidget(container.more_btn, 0, Qt.AlignmentFlag.AlignCenter)
     container.layout().addStretch(1)
 
 
-def load_table_data(container: QWidget, query: str = ''):
-    """加载表格数据"""
-    file_list = get_file_list(gcache.current_user, query)
-    MyQLabelTip(f"查询完成, 共{len(file_list)}条数据!", container)
-    container.file_list = file_list  # 保存文件列表
+def load_table_data(container: QWidget, query: str = '', cursor: str = None):
+    """加载表格数据, cursor 为空时重新加载第一页, 否则在表格末尾追加下一页"""
+    # 搜索时按相关度排序
+    page = get_file_page(gcache.current_user, query, cursor, sort='rank' if query else 'file_name', with_total=not cursor)
+    file_list = page['rows']
+    if not cursor:
+        MyQLabelTip(f"查询完成, 共{page['total']}{'' if page['total_exact'] else '+'}条数据!", container)
+        container.file_list = []  # 保存已加载的文件列表
+        container.table.setRowCount(0)  # 清空表格
     container.query = query  # 保存搜索字段
-    container.table.setRowCount(0)  # 清空表格
+    container.next_cursor = page['next_cursor']  # 保存下一页游标
+    container.more_btn.setVisible(bool(page['next_cursor']))
     table = container.table
-    for index, file in enumerate(file_list):
+    for index, file in enumerate(file_list, len(container.file_list)):
         row = table.rowCount()
         table.insertRow(row)
         # 加载每行表格内容
@@ -178,6 +199,7 @@ def load_table_data(container: QWidget, query: str = ''):
             btn_copy = create_copy_button(container, file)
             button_layout.addWidget(btn_copy)
         container.table.setCellWidget(row, 5, option_widget)
+    container.file_list.extend(file_list)
 
 
 def create_download_button(container, file):
@@ -14,7 +14,7 @@ from PySide6.QtWidgets import (
 )
 
 from interface.custom_widget import MyQLabelTip
-from module.user_apis import delete_user, get_user_list
+from module.user_apis import delete_user, get_user_page
 from setting.global_variant import gcache
 
 
@@ -125,6 +125,21 @@ def _build_user_table(main_window: QMainWindow, container: QWidget):
     )
     container.table.setRowHeight(0, 48)  # 设置行高
     container.table.setFixedHeight(400)
+    # 加载下一页按钮, 没有下一页时隐藏
+    container.more_btn = QPushButton("加载更多")
+    container.more_btn.setStyleSheet(
+        """
+        QPushButton {
+            background: #409EFF44;
+            color: white;
+            padding: 8px 16px;
+            border-radius: 4px;
+            border: none;
+        }
+        QPushButton:hover { background: #66b1ff; }
+    """
+    )
+    container.more_btn.clicked.connect(lambda: load_table_data(container, container.query, container.next_cursor))
     # 加载默认表格数据
     load_table_data(container)
 
@@ -132,6 +147,7 @@ def _build_user_table(main_window: QMainWindow, container: QWidget):
     container.layout().addSpacing(20)
     container.layout().addLayout(search_layout)
     container.layout().addWidget(container.table)
+    container.layout().addWidget(container.more_btn, 0, Qt.AlignmentFlag.AlignCenter)
     container.layout().addStretch(1)
 
 
@@ -141,15 +157,20 @@ def _handle_delete_user(container: QWidget, row_index: int):
     load_table_data(container, container.query)
 
 
-def load_table_data(container: QWidget, query: str = ''):
-    """加载表格数据"""
-    user_list = get_user_list(gcache.current_user, query)
-    MyQLabelTip(f"查询完成, 共{len(user_list)}条数据!", container)
-    container.user_list = user_list  # 保存用户列表
+def load_table_data(container: QWidget, query: str = '', cursor: str = None):
+    """加载表格数据, cursor 为空时重新加载第一页, 否则在表格末尾追加下一页"""
+    # 搜索时按相关度排序
+    page = get_user_page(gcache.current_user, query, cursor, sort='rank' if query else 'username', with_total=not cursor)
+    user_list = page['rows']
+    if not cursor:
+        MyQLabelTip(f"查询完成, 共{page['total']}{'' if page['total_exact'] else '+'}条数据!", container)
+        container.user_list = []  # 保存已加载的用户列表
+        container.table.setRowCount(0)
     container.query = query  # 保存查询字段
-    container.table.setRowCount(0)
+    container.next_cursor = page['next_cursor']  # 保存下一页游标
+    container.more_btn.setVisible(bool(page['next_cursor']))
     table = container.table
-    for index, user in enumerate(user_list):
+    for index, user in enumerate(user_list, len(container.user_list)):
         row = table.rowCount()
         table.insertRow(row)
         # 加载表格内容
@@ -176,3 +197,4 @@ def load_table_data(container: QWidget, query: str = ''):
         btn.clicked.connect(lambda _, r=row: _handle_delete_user(container, r))
         if user['role'] == 'user':
             table.setCellWidget(row, 5, btn)
+    container.user_list.extend(user_list)
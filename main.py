@@ -6,10 +6,12 @@ from PySide6.QtWidgets import QApplication
 from db_data.manager import db  # 初始化数据库
 from interface.splash_sfg import SplashScreen
 from interface.window_login import LoginWindow
+from module.backend_apis import select_backends
 from setting.config_loader import config
 
 if __name__ == "__main__":
     db.init_amdin_user()
+    select_backends()  # 选择各算法最快的加密后端(首次运行时测速并缓存)
     app = QApplication(sys.argv)
 
     # 第一步：显示启动页
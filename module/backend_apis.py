@@ -0,0 +1,137 @@
+import json
+import os
+import platform
+import time
+from pathlib import Path
+
+import Crypto
+import cryptography
+
+from module.cipher_registry import CIPHERS, CipherSpec
+from module.common import create_dir_if_not_exists
+from setting.config_loader import config
+
+CALIBRATION_SAMPLE_SIZE = 4 * 1024 * 1024  # 测速样本大小
+_selection = {}  # 当前选择结果: 算法名 -> {'backend', 'source'}
+_calibration = {}  # 测速结果: 算法名 -> {后端名: {'cbc': MB/s, 'gcm': MB/s}}
+
+
+def _environment() -> dict:
+    """当前机器和加密库版本, 任一变化都需要重新测速"""
+    return {
+        'machine': platform.node(),
+        'processor': platform.processor() or platform.machine(),
+        'cryptography': cryptography.__version__,
+        'pycryptodome': Crypto.__version__,
+    }
+
+
+def _measure(spec: CipherSpec, key: bytes, sample: bytes) -> tuple:
+    """测量当前后端的加密吞吐量(MB/s), 同时返回密文用于校验各后端输出一致"""
+    speed, outputs = {}, []
+
+    start = time.perf_counter()
+    ctx = spec.new_cbc(key, b'\0' * spec.iv_size)
+    outputs.append(ctx.update(sample) + ctx.finalize())
+    speed['cbc'] = len(sample) / (time.perf_counter() - start) / 1024 / 1024
+
+    if spec.aead:
+        start = time.perf_counter()
+        encryptor = spec.gcm_factory(key, b'\0' * 12)
+        outputs.append(encryptor.update(sample) + encryptor.finalize() + encryptor.tag)
+        speed['gcm'] = len(sample) / (time.perf_counter() - start) / 1024 / 1024
+    return speed, outputs
+
+
+def calibrate(sample_size: int = CALIBRATION_SAMPLE_SIZE) -> dict:
+    """
+    对每个算法的每个可用后端测速
+    输出与默认后端不一致的后端会被排除, 保证切换后端不会影响已有密文
+    :return: 算法名 -> {后端名: {'cbc': MB/s, 'gcm': MB/s}}
+    """
+    sample = os.urandom(sample_size)
+    results = {}
+    for spec in CIPHERS.values():
+        current = spec.backend
+        key = os.urandom(spec.key_size)
+        reference = None
+        results[spec.name] = {}
+        for backend in spec.backends:
+            spec.use_backend(backend)
+            speed, outputs = _measure(spec, key, sample)
+            if reference is None:
+                reference = outputs
+            elif outputs != reference:
+                print(f"{spec.name} 后端 {backend} 输出与默认后端不一致, 已忽略")
+                continue
+            results[spec.name][backend] = {mode: round(value, 1) for mode, value in speed.items()}
+        spec.use_backend(current)
+    return results
+
+
+def _fastest(speeds: dict) -> str:
+    """按总耗时(各模式耗时之和)选择最快的后端"""
+    return min(speeds, key=lambda backend: sum(1 / value for value in speeds[backend].values()))
+
+
+def _load_calibration(cache_file: Path) -> dict:
+    """读取缓存的测速结果, 机器或库版本变化时视为无效"""
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if cache.get('environment') != _environment():
+        return {}
+    return cache.get('results', {})
+
+
+def select_backends(recalibrate: bool = False) -> dict:
+    """
+    为每个算法选择加密后端, 启动时调用一次
+    优先使用配置文件 crypto.backends 中的指定, 否则使用测速结果中最快的后端
+    测速结果缓存在 crypto.backend_cache 文件中, 每台机器只测一次
+    :param recalibrate: 忽略缓存重新测速
+    :return: 算法名 -> {'backend': 后端名, 'source': override/calibrated/default}
+    """
+    cache_file = Path(config.crypto.backend_cache)
+    results = {} if recalibrate else _load_calibration(cache_file)
+    if set(results) != set(CIPHERS):
+        results = calibrate()
+        create_dir_if_not_exists(cache_file)
+        with open(cache_file, 'w', encoding='utf-8') as f:
+            json.dump({'environment': _environment(), 'results': results}, f, ensure_ascii=False, indent=2)
+    _calibration.clear()
+    _calibration.update(results)
+
+    overrides = vars(config.crypto.backends) if config.crypto.backends else {}
+    for name, spec in CIPHERS.items():
+        speeds = {backend: speed for backend, speed in results.get(name, {}).items() if backend in spec.backends}
+        if name in overrides:
+            backend, source = overrides[name], 'override'
+        elif speeds:
+            backend, source = _fastest(speeds), 'calibrated'
+        else:
+            backend, source = spec.backend, 'default'
+        spec.use_backend(backend)
+        _selection[name] = {'backend': backend, 'source': source}
+    return dict(_selection)
+
+
+def get_backend_diagnostics() -> list:
+    """诊断信息: 每个算法当前使用的后端、选择来源以及各后端的测速结果(MB/s)"""
+    return [
+        {
+            'algorithm': name,
+            'backend': spec.backend,
+            'source': _selection.get(name, {}).get('source', 'default'),
+            'available': list(spec.backends),
+            'throughput': _calibration.get(name, {}),
+        }
+        for name, spec in CIPHERS.items()
+    ]
+
+
+if __name__ == "__main__":
+    select_backends(recalibrate=True)
+    print(json.dumps(get_backend_diagnostics(), ensure_ascii=False, indent=2))
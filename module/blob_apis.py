@@ -0,0 +1,432 @@
+"""
+密文文件存储
+
+所有密文文件都先写入同目录下的临时文件, 写完后通过 os.replace 原子地替换到目标路径,
+崩溃或并发下载时只会看到完整的旧文件或完整的新文件, 不会看到写了一半的文件.
+落盘策略由 crypto.fsync 配置:
+    always: 每个文件替换前 fsync 文件, 替换后 fsync 目录, 最安全
+    batch:  每 crypto.fsync_batch 个文件统一 fsync 一次, 两次同步之间崩溃可能丢失最近写入的文件
+    none:   不主动 fsync, 交给操作系统, 适合可重做的批量导入
+密文路径由 crypto.blob_layout 决定:
+    user: upload/<用户名>/<文件名><时间戳>, 旧版布局, 单个用户的文件都在同一个目录中
+    hash: upload/ab/cd/<随机名>, 随机名的前两级作为子目录, 文件均匀分布在 65536 个目录中, 单个目录不会过大
+已有文件可通过 python -m module.layout_apis 迁移到当前布局.
+小于 crypto.pack_threshold 的文件不单独存储, 而是追加到 config.path.pack 下的 pack 文件中,
+数据库记录 (pack文件id, 偏移量, 长度), 读取时一次 pread 取出; pack 文件由 python -m module.pack_apis 整理.
+config.path.upload_roots 可以配置多个上传目录(如不同的磁盘)及权重, 新文件按 权重 x 剩余空间 / (进行中的写入数+1)
+随机选择目录, 剩余空间低于 crypto.upload_min_free 的目录不再放置新文件; 所在目录记录在 sfg_encrypted_file.blob_root 中,
+某个目录将满时由 python -m module.rebalance_apis 把文件移到其他目录.
+写入的同时计算密文的 BLAKE2b 摘要, 保存在 sfg_encrypted_file.blob_digest 中, 不需要密码即可校验密文是否完整.
+"""
+
+import atexit
+import hashlib
+import io
+import os
+import random
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+from db_data.manager import db
+from module.common import RateLimiter, create_dir_if_not_exists
+from setting.config_loader import config
+
+DIGEST_SIZE = 32  # BLAKE2b 摘要长度(字节)
+HASH_CHUNK_SIZE = 1024 * 1024  # 校验时每次读取的长度
+_pending_sync = []  # batch 模式下尚未 fsync 的文件
+_sync_lock = threading.Lock()
+_pack_lock = threading.Lock()
+FANOUT_WIDTH = 2  # hash 布局每级子目录名的长度(十六进制字符)
+_root_load = Counter()  # 各上传目录正在进行的写入数
+_HASH_NAME = re.compile(r'[0-9a-f]{32}')  # hash 布局的随机名(uuid4 hex)
+_USER_NAME = re.compile(r'.*\d+\.\d+', re.S)  # user 布局: 文件名 + str(time.time())
+_TEMP_NAME = re.compile(r'\.(.*)\.\d+\.\d+\.tmp', re.S)  # atomic_write 的临时文件, 分组为目标文件名
+
+
+def upload_roots() -> list:
+    """配置的上传目录及权重 [(目录, 权重), ...], 没有配置 upload_roots 时只有 config.path.upload"""
+    roots = getattr(config.path, 'upload_roots', None)
+    if not roots:
+        return [(config.path.upload, 1)]
+    return [(root['path'], root.get('weight', 1)) for root in roots]
+
+
+def root_of(file_path) -> str:
+    """密文所在的上传目录, 不在任何上传目录中时返回 None"""
+    path = os.path.abspath(file_path)
+    for root, _ in upload_roots():
+        root_path = os.path.abspath(root)
+        if os.path.commonpath([path, root_path]) == root_path:
+            return root
+    return None
+
+
+def free_space(root: str) -> int:
+    """上传目录所在磁盘的剩余空间"""
+    os.makedirs(root, exist_ok=True)
+    return shutil.disk_usage(root).free
+
+
+def choose_root(exclude: set = frozenset()) -> str:
+    """
+    为新文件选择上传目录, 按 权重 x 剩余空间 / (进行中的写入数+1) 加权随机选择
+    :param exclude: 不选择这些目录, 平衡各目录时使用
+    """
+    roots = [(root, weight) for root, weight in upload_roots() if root not in exclude]
+    if len(roots) == 1 and not exclude:
+        return roots[0][0]
+    candidates, scores = [], []
+    for root, weight in roots:
+        free = free_space(root)
+        if free >= config.crypto.upload_min_free:
+            candidates.append(root)
+            scores.append(weight * free / (_root_load[root] + 1))
+    if not candidates:
+        raise OSError("所有上传目录的剩余空间都不足")
+    return random.choices(candidates, weights=scores)[0]
+
+
+def new_blob_path(username: str, filename: str, layout: str = None, root: str = None) -> Path:
+    """
+    生成新密文的存储路径, 文件id在写入密文之后才分配, 因此 hash 布局使用随机名
+    :param username: 上传用户
+    :param filename: 原始文件名
+    :param layout: 存储布局, 默认 crypto.blob_layout
+    :param root: 上传目录, 默认由 choose_root 选择
+    """
+    layout = layout or config.crypto.blob_layout
+    root = Path(root or choose_root())
+    if layout == 'hash':
+        name = uuid.uuid4().hex
+        return root / name[:FANOUT_WIDTH] / name[FANOUT_WIDTH : FANOUT_WIDTH * 2] / name
+    if layout == 'user':
+        return root / username / (filename + str(time.time()))
+    raise ValueError(f"不支持的存储布局 {layout}")
+
+
+def blob_layout(file_path) -> str:
+    """根据密文路径判断所属的存储布局"""
+    parts = Path(file_path).parts
+    if len(parts) >= 3 and parts[-1][: FANOUT_WIDTH * 2] == parts[-3] + parts[-2] and len(parts[-3]) == len(parts[-2]) == FANOUT_WIDTH:
+        return 'hash'
+    return 'user'
+
+
+def is_blob_name(relative_path) -> bool:
+    """
+    判断上传目录下的相对路径是否符合 new_blob_path 生成的密文命名,
+    atomic_write 的临时文件、隐藏目录中的文件以及 .gitkeep 等其他文件返回 False
+    """
+    parts = Path(relative_path).parts
+    if not parts or any(part.startswith('.') for part in parts[:-1]) or _TEMP_NAME.fullmatch(parts[-1]):
+        return False
+    if len(parts) == 3:
+        return blob_layout(relative_path) == 'hash' and bool(_HASH_NAME.fullmatch(parts[-1]))
+    return len(parts) == 2 and bool(_USER_NAME.fullmatch(parts[-1]))
+
+
+def is_temp_blob_name(relative_path) -> bool:
+    """判断上传目录下的相对路径是否是写入密文时 atomic_write 的临时文件(写入中或崩溃后残留)"""
+    parts = Path(relative_path).parts
+    match = _TEMP_NAME.fullmatch(parts[-1]) if parts else None
+    return bool(match) and is_blob_name(Path(*parts[:-1], match.group(1)))
+
+
+def new_blob_hash():
+    return hashlib.blake2b(digest_size=DIGEST_SIZE)
+
+
+class HashingFile(object):
+    """包装写入的文件对象, 写入的同时计算摘要, 其余属性(fileno/truncate等)直接转发"""
+
+    def __init__(self, f):
+        self._f = f
+        self._hash = new_blob_hash()
+
+    def write(self, data) -> int:
+        self._hash.update(data)
+        return self._f.write(data)
+
+    def update_digest(self, data):
+        """内存映射写入不经过 write, 由调用方传入最终写入的内容"""
+        self._hash.update(data)
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+
+def _fsync_path(path: Path):
+    """fsync 已关闭的文件"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_dir(path: Path):
+    """fsync 目录, 保证重命名落盘, Windows 不支持打开目录, 直接跳过"""
+    if os.name != 'nt':
+        _fsync_path(path)
+
+
+def flush_blobs():
+    """立即 fsync batch 模式下尚未同步的文件, 批量任务结束时调用"""
+    with _sync_lock:
+        paths = list(_pending_sync)
+        _pending_sync.clear()
+    for path in paths:
+        try:
+            _fsync_path(path)
+        except FileNotFoundError:
+            continue  # 同步前已被删除或替换
+    for directory in {path.parent for path in paths}:
+        _fsync_dir(directory)
+
+
+def _schedule_sync(path: Path):
+    with _sync_lock:
+        _pending_sync.append(path)
+        full = len(_pending_sync) >= config.crypto.fsync_batch
+    if full:
+        flush_blobs()
+
+
+@contextmanager
+def atomic_write(file_path, mode: str = 'wb'):
+    """
+    原子写入文件: 返回临时文件对象(HashingFile), 正常退出时按落盘策略同步并替换到目标路径, 异常时删除临时文件
+    :param file_path: 目标路径
+    :param mode: 打开模式, 内存映射写入时使用 w+b
+    """
+    file_path = Path(file_path)
+    create_dir_if_not_exists(file_path)
+    policy = config.crypto.fsync
+    temp_path = file_path.with_name(f'.{file_path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    root = root_of(file_path)
+    with _sync_lock:
+        _root_load[root] += 1  # 选择上传目录时参考各目录进行中的写入数
+    try:
+        with open(temp_path, mode) as f:
+            yield HashingFile(f)
+            f.flush()
+            if policy == 'always':
+                os.fsync(f.fileno())
+        os.replace(temp_path, file_path)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    finally:
+        with _sync_lock:
+            _root_load[root] -= 1
+    if policy == 'always':
+        _fsync_dir(file_path.parent)
+    elif policy == 'batch':
+        _schedule_sync(file_path)
+
+
+class PackedBlob(object):
+    """写入 pack 文件的小密文, 作为 encrypt_file 的 file_path 传入, 写入完成后记录所在位置"""
+
+    def __init__(self):
+        self.file_path = None  # pack 文件路径
+        self.location = None  # (pack文件id, 偏移量, 长度)
+
+
+def new_blob_target(username: str, filename: str, size: int):
+    """
+    新密文的写入目标: 小于 crypto.pack_threshold 的小文件追加到 pack 文件, 其余文件单独存储(pack_threshold 为 0 时不启用)
+    :param size: 明文大小
+    """
+    if size < config.crypto.pack_threshold:
+        return PackedBlob()
+    return new_blob_path(username, filename)
+
+
+def blob_location(target) -> tuple:
+    """写入完成后保存到数据库的 (密文路径, 上传目录, pack位置), pack 文件中的密文没有上传目录, 单独存储的文件没有 pack位置"""
+    if isinstance(target, PackedBlob):
+        return target.file_path, None, target.location
+    return Path(target).as_posix(), root_of(target), None
+
+
+def discard_blob(target):
+    """清理写入失败的密文, pack 文件中已追加的内容由整理任务回收"""
+    if not isinstance(target, PackedBlob):
+        Path(target).unlink(missing_ok=True)
+
+
+def remove_blob(file_dict: dict):
+    """删除不再使用的密文, pack 文件中的密文由整理任务回收"""
+    if not file_dict.get('pack_segment'):
+        Path(file_dict['file_path']).unlink(missing_ok=True)
+
+
+def append_pack(data) -> tuple:
+    """
+    追加密文到当前的 pack 文件, 当前文件写满时封存并新建
+    当前文件不存在时(登记后创建文件前崩溃, 或被误删)同样封存并新建, 不在原路径上重建, 避免新内容与记录中已有的偏移量重叠
+    以 O_APPEND 方式写入, 多个进程同时追加也不会互相覆盖
+    :return: (pack 文件路径, (pack文件id, 偏移量, 长度))
+    """
+    with _pack_lock:
+        segment = db.get_active_pack_segment()
+        if segment and (not os.path.exists(segment['file_path']) or os.path.getsize(segment['file_path']) + len(data) > config.crypto.pack_segment_size):
+            db.seal_pack_segment(segment['id'])
+            segment = None
+        if segment is None:
+            file_path = (Path(config.path.pack) / f'{uuid.uuid4().hex}.pack').as_posix()
+            create_dir_if_not_exists(file_path)
+            segment = {'id': db.create_pack_segment(file_path), 'file_path': file_path}
+        fd = os.open(segment['file_path'], os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, 'O_BINARY', 0))
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view) :]
+            end = os.lseek(fd, 0, os.SEEK_CUR)  # 追加写入后的位置即本次写入的结尾
+            policy = config.crypto.fsync
+            if policy == 'always':
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+    if policy == 'always':
+        _fsync_dir(Path(segment['file_path']).parent)
+    elif policy == 'batch':
+        _schedule_sync(Path(segment['file_path']))
+    return segment['file_path'], (segment['id'], end - len(data), len(data))
+
+
+@contextmanager
+def pack_write(target: PackedBlob):
+    """小文件先在内存中加密, 写完后一次追加到 pack 文件"""
+    buffer = io.BytesIO()
+    dst = HashingFile(buffer)
+    yield dst
+    target.file_path, target.location = append_pack(buffer.getbuffer())
+
+
+def write_blob(target, mode: str = 'wb'):
+    """按写入目标选择追加到 pack 文件或原子写入单独的文件"""
+    if isinstance(target, PackedBlob):
+        return pack_write(target)
+    return atomic_write(target, mode)
+
+
+def _pread(path: str, offset: int, length: int) -> bytes:
+    fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        if hasattr(os, 'pread'):
+            return os.pread(fd, length, offset)
+        os.lseek(fd, offset, os.SEEK_SET)  # Windows 没有 pread
+        return os.read(fd, length)
+    finally:
+        os.close(fd)
+
+
+def read_packed(file_dict: dict) -> bytes:
+    """一次定位读取 pack 文件中的密文, pack 文件在读取前被整理删除时按数据库中的新位置重试"""
+    try:
+        return _pread(file_dict['file_path'], file_dict['pack_offset'], file_dict['pack_length'])
+    except FileNotFoundError:
+        current = db.get_file_by_id(file_dict['id'])
+        if not current or current['pack_segment'] == file_dict['pack_segment']:
+            raise
+        return _pread(current['file_path'], current['pack_offset'], current['pack_length'])
+
+
+def open_blob(file_dict: dict):
+    """以只读文件对象打开密文, pack 文件中的密文读入内存"""
+    if file_dict.get('pack_segment'):
+        return io.BytesIO(read_packed(file_dict))
+    return open(file_dict['file_path'], 'rb')
+
+
+def blob_size(file_dict: dict) -> int:
+    """密文长度"""
+    if file_dict.get('pack_segment'):
+        return file_dict['pack_length']
+    return os.path.getsize(file_dict['file_path'])
+
+
+def blob_digest(file_dict: dict, limiter: RateLimiter = None) -> str:
+    """
+    流式计算密文的摘要
+    :param file_dict: 数据库中的文件记录
+    :param limiter: 读取限速, 后台校验时使用
+    """
+    digest = new_blob_hash()
+    buffer = memoryview(bytearray(HASH_CHUNK_SIZE))
+    with open_blob(file_dict) as f:
+        while n := f.readinto(buffer):
+            digest.update(buffer[:n])
+            if limiter:
+                limiter.acquire(n)
+    return digest.hexdigest()
+
+
+def check_blob(file_dict: dict, backfill: bool = False, limiter: RateLimiter = None) -> str:
+    """
+    校验单个密文文件, 不需要密码
+    :param file_dict: 数据库中的文件记录
+    :param backfill: 没有记录摘要的旧文件, 是否把当前摘要写入数据库
+    :param limiter: 读取限速
+    :return: ok(完整) / corrupt(摘要不一致) / missing(文件不存在) / unknown(没有记录摘要)
+    """
+    try:
+        digest = blob_digest(file_dict, limiter)
+    except FileNotFoundError:
+        return 'missing'
+    if not file_dict.get('blob_digest'):
+        if backfill:
+            # 读取期间密文被重新加密、迁移或整理时记录已指向新密文, 不能写入旧密文的摘要, 跳过等下次校验
+            expected = {'file_path': file_dict['file_path'], 'pack_offset': file_dict.get('pack_offset'), 'blob_digest': None}
+            db.update_file_info(file_dict['id'], {'blob_digest': digest}, expected)
+        return 'unknown'
+    return 'ok' if digest == file_dict['blob_digest'] else 'corrupt'
+
+
+def verify_blob(file_id: int) -> tuple:
+    """校验文件的密文是否完整, 返回 (是否完整, 提示信息)"""
+    file_dict = db.get_file_by_id(file_id)
+    if not file_dict:
+        return False, "文件不存在"
+    status = check_blob(file_dict)
+    messages = {'ok': "密文完整", 'corrupt': "密文已损坏", 'missing': "密文文件丢失", 'unknown': "没有记录密文摘要, 无法校验"}
+    return status == 'ok', messages[status]
+
+
+def verify_blobs(files: list = None, workers: int = None, backfill: bool = False) -> dict:
+    """
+    批量校验密文, 多线程并行读取计算摘要(BLAKE2b 计算时释放GIL), 不需要密码
+    :param files: 文件记录列表, 不传时校验全部文件
+    :param workers: 并行线程数, 默认 crypto.verify_workers
+    :param backfill: 同 check_blob
+    :return: 状态 -> 文件id列表
+    """
+    files = db.get_file_list() if files is None else files
+    result = {'ok': [], 'corrupt': [], 'missing': [], 'unknown': []}
+    with ThreadPoolExecutor(max_workers=workers or config.crypto.verify_workers) as pool:
+        for file_dict, status in zip(files or [], pool.map(lambda file_dict: check_blob(file_dict, backfill), files or [])):
+            result[status].append(file_dict['id'])
+    return result
+
+
+atexit.register(flush_blobs)
+
+
+if __name__ == "__main__":
+    report = verify_blobs()
+    print({status: len(ids) for status, ids in report.items()})
+    for status in ('corrupt', 'missing'):
+        if report[status]:
+            print(status, report[status])
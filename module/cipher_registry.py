@@ -0,0 +1,215 @@
+"""
+加密算法注册表
+
+每个算法注册一个 CipherSpec 描述: 分组长度、密钥长度、IV长度、可用的后端(CBC/GCM工厂)、是否支持流式处理.
+上传、编辑、校验、下载都通过注册表分发, 新增算法或更快的后端只需要注册一次.
+同一算法的不同后端输出完全一致, 可以通过 use_backend 随时切换.
+"""
+
+from Crypto.Cipher import AES, DES
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+from setting.global_variant import DELIMITER
+
+_BACKENDS = {}  # 缓存后端对象, 避免每次加解密都重新获取
+CIPHERS = {}  # 已注册的算法: 算法名 -> CipherSpec
+PADDING = [bytes([pad_len]) * pad_len for pad_len in range(33)]  # PKCS7 填充表, 避免每次拼接填充字节
+
+
+def get_backend(name: str):
+    """获取(并缓存)加密后端对象"""
+    if name not in _BACKENDS:
+        match name:
+            case 'cryptography':
+                _BACKENDS[name] = default_backend()
+            case _:
+                raise ValueError(f"不支持的加密后端 {name}")
+    return _BACKENDS[name]
+
+
+def cryptography_cbc(algorithm_cls):
+    """cryptography 后端的CBC上下文工厂, 上下文支持 update / update_into / finalize"""
+
+    def factory(key: bytes, iv: bytes, decrypt: bool = False):
+        cipher = Cipher(algorithm_cls(key), modes.CBC(iv), backend=get_backend('cryptography'))
+        return cipher.decryptor() if decrypt else cipher.encryptor()
+
+    return factory
+
+
+def cryptography_gcm(algorithm_cls):
+    """cryptography 后端的GCM上下文工厂, 返回加/解密上下文对象"""
+
+    def factory(key: bytes, nonce: bytes, tag: bytes = None):
+        cipher = Cipher(algorithm_cls(key), modes.GCM(nonce, tag), backend=get_backend('cryptography'))
+        return cipher.decryptor() if tag else cipher.encryptor()
+
+    return factory
+
+
+class _PycryptodomeCBC(object):
+    """将 pycryptodome 的CBC对象适配为 cryptography 的上下文接口, CBC对象会保留链式状态, 可分块多次调用"""
+
+    def __init__(self, cipher, decrypt: bool = False):
+        self._func = cipher.decrypt if decrypt else cipher.encrypt
+
+    def update(self, data: bytes) -> bytes:
+        return self._func(data)
+
+    def update_into(self, data, out) -> int:
+        self._func(data, output=out[: len(data)])
+        return len(data)
+
+    def finalize(self) -> bytes:
+        return b''
+
+
+def pycryptodome_cbc(module):
+    """pycryptodome 后端的CBC上下文工厂"""
+
+    def factory(key: bytes, iv: bytes, decrypt: bool = False):
+        return _PycryptodomeCBC(module.new(key, module.MODE_CBC, iv), decrypt)
+
+    return factory
+
+
+class _PycryptodomeGCM(object):
+    """将 pycryptodome 的GCM对象适配为 cryptography 的上下文接口"""
+
+    def __init__(self, cipher, tag: bytes = None):
+        self._cipher = cipher
+        self._tag = tag
+        self._func = cipher.decrypt if tag else cipher.encrypt
+
+    def authenticate_additional_data(self, data: bytes):
+        self._cipher.update(data)
+
+    def update(self, data: bytes) -> bytes:
+        return self._func(data)
+
+    def update_into(self, data, out) -> int:
+        self._func(data, output=out[: len(data)])
+        return len(data)
+
+    def finalize(self) -> bytes:
+        if self._tag:
+            try:
+                self._cipher.verify(self._tag)
+            except ValueError:
+                raise InvalidTag() from None
+        return b''
+
+    @property
+    def tag(self) -> bytes:
+        return self._cipher.digest()
+
+
+def pycryptodome_gcm(module):
+    """pycryptodome 后端的GCM上下文工厂"""
+
+    def factory(key: bytes, nonce: bytes, tag: bytes = None):
+        return _PycryptodomeGCM(module.new(key, module.MODE_GCM, nonce=nonce, mac_len=16), tag)
+
+    return factory
+
+
+class CipherSpec(object):
+    """加密算法描述"""
+
+    def __init__(self, name: str, block_size: int, key_size: int, iv_size: int, backends: dict, streaming: bool = True):
+        """
+        :param name: 算法名称, 与数据库 algorithm 字段一致
+        :param block_size: 分组长度
+        :param key_size: 密钥长度, 密码不足时使用 DELIMITER 左侧填充
+        :param iv_size: CBC模式IV长度
+        :param backends: 后端名 -> (cbc工厂, gcm工厂), 第一个为默认后端
+            cbc工厂: (key, iv, decrypt) -> CBC上下文(update / update_into / finalize)
+            gcm工厂: (key, nonce, tag) -> GCM上下文, 算法不支持AEAD时为None
+        :param streaming: 是否支持分块多次调用update
+        """
+        self.name = name
+        self.block_size = block_size
+        self.key_size = key_size
+        self.iv_size = iv_size
+        self.backends = backends
+        self.streaming = streaming
+        self.aead = next(iter(backends.values()))[1] is not None  # 是否支持GCM由算法决定, 与后端无关
+        self.use_backend(next(iter(backends)))
+
+    def __repr__(self):
+        return f'CipherSpec({self.name}, backend={self.backend})'
+
+    def use_backend(self, backend: str):
+        """切换当前使用的后端"""
+        if backend not in self.backends:
+            raise ValueError(f"{self.name} 不支持后端 {backend}, 可选: {list(self.backends)}")
+        self.backend = backend
+        self.cbc_factory, self.gcm_factory = self.backends[backend]
+
+    def fill_password(self, password: str) -> str:
+        """填充密码到密钥长度"""
+        return password.rjust(self.key_size, DELIMITER)
+
+    def new_cbc(self, key: bytes, iv: bytes, decrypt: bool = False):
+        """创建CBC上下文, update_into 的输出缓冲区至少需要 输入长度+分组长度-1"""
+        return self.cbc_factory(key, iv, decrypt)
+
+
+def register_cipher(spec: CipherSpec):
+    """注册加密算法, 同名算法会被覆盖"""
+    CIPHERS[spec.name] = spec
+
+
+def current_backends() -> dict:
+    """当前各算法使用的后端: 算法名 -> 后端名"""
+    return {name: spec.backend for name, spec in CIPHERS.items()}
+
+
+def apply_backends(backends: dict):
+    """批量切换后端, 用于让子进程与主进程使用相同的后端"""
+    for name, backend in backends.items():
+        get_cipher(name).use_backend(backend)
+
+
+def get_cipher(name: str) -> CipherSpec:
+    """根据算法名获取算法描述"""
+    try:
+        return CIPHERS[name]
+    except KeyError:
+        raise ValueError(f"不支持的加密算法 {name}") from None
+
+
+register_cipher(
+    CipherSpec(
+        'AES',
+        16,
+        32,
+        16,
+        {
+            'cryptography': (cryptography_cbc(algorithms.AES), cryptography_gcm(algorithms.AES)),
+            'pycryptodome': (pycryptodome_cbc(AES), pycryptodome_gcm(AES)),
+        },
+    )
+)
+register_cipher(CipherSpec('SM4', 16, 16, 16, {'cryptography': (cryptography_cbc(algorithms.SM4), cryptography_gcm(algorithms.SM4))}))
+# 3DES 使用8位密钥时三段子密钥相同, 等价于单DES, pycryptodome 的DES3会拒绝这种密钥, 因此直接使用DES
+register_cipher(
+    CipherSpec(
+        '3DES',
+        8,
+        8,
+        8,
+        {'cryptography': (cryptography_cbc(algorithms.TripleDES), None), 'pycryptodome': (pycryptodome_cbc(DES), None)},
+    )
+)
+register_cipher(
+    CipherSpec(
+        'DES',
+        8,
+        8,
+        8,
+        {'pycryptodome': (pycryptodome_cbc(DES), None), 'cryptography': (cryptography_cbc(algorithms.TripleDES), None)},
+    )
+)
@@ -1,6 +1,8 @@
 import os
 import random
 import string
+import threading
+import time
 from pathlib import Path
 
 from passlib.context import CryptContext
@@ -62,6 +64,29 @@ def create_dir_if_not_exists(file_path: Path):
         os.makedirs(file_path.parent)  # 创建多层文件夹
 
 
+class RateLimiter(object):
+    """按字节数限速, 可在多个线程间共用, rate 为0时不限速"""
+
+    def __init__(self, rate: float):
+        """
+        :param rate: 每秒允许处理的字节数
+        """
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next = time.monotonic()  # 下一次允许开始处理的时间
+
+    def acquire(self, size: int):
+        """处理 size 字节之前调用, 超出速率时阻塞等待"""
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(self._next, now)
+            self._next = start + size / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+
 def handle_set_strong_password(container: QWidget, password_line: QWidget):
     """生成强密码并复制到剪贴板"""
     password = generate_strong_password()
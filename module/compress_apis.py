@@ -0,0 +1,141 @@
+"""
+加密前的压缩阶段
+
+压缩在加密之前进行(密文无法压缩), 每个文件使用的压缩算法记录在 sfg_encrypted_file.compression 字段中, none 表示未压缩.
+上传时先对开头的数据试压缩, 图片、视频、压缩包等已压缩的数据压缩率很低, 直接跳过压缩.
+压缩和解压都是流式进行的, 内存占用与文件大小无关.
+"""
+
+import io
+import lzma
+import zlib
+
+from setting.config_loader import config
+
+CODECS = {}  # 已注册的压缩算法: 算法名 -> Codec
+DECOMPRESS_LIMIT = 1024 * 1024  # 每次解压输出的最大长度, 避免高压缩率的数据一次解压占用过多内存
+
+
+class Codec(object):
+    """压缩算法描述, 解压对象支持限制输出长度时由子类实现分批解压"""
+
+    def __init__(self, name: str, compressor, decompressor):
+        """
+        :param name: 算法名称, 与数据库 compression 字段一致
+        :param compressor: () -> 压缩对象(compress / flush)
+        :param decompressor: () -> 解压对象
+        """
+        self.name = name
+        self.compressor = compressor
+        self.decompressor = decompressor
+
+    def decompress_chunks(self, decompressor, data):
+        """解压一块数据, 按 DECOMPRESS_LIMIT 分批生成明文; 默认一次解压, 适用于不支持限制输出长度的解压对象"""
+        yield decompressor.decompress(data)
+
+
+class ZlibCodec(Codec):
+    def decompress_chunks(self, decompressor, data):
+        yield decompressor.decompress(data, DECOMPRESS_LIMIT)
+        while decompressor.unconsumed_tail:
+            yield decompressor.decompress(decompressor.unconsumed_tail, DECOMPRESS_LIMIT)
+
+
+class LzmaCodec(Codec):
+    def decompress_chunks(self, decompressor, data):
+        if decompressor.eof:
+            return
+        yield decompressor.decompress(data, DECOMPRESS_LIMIT)
+        while not decompressor.needs_input and not decompressor.eof:
+            yield decompressor.decompress(b'', DECOMPRESS_LIMIT)
+
+
+def register_codec(codec: Codec):
+    """注册压缩算法, 同名算法会被覆盖"""
+    CODECS[codec.name] = codec
+
+
+def get_codec(name: str) -> Codec:
+    """根据算法名获取压缩算法"""
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f"不支持的压缩算法 {name}") from None
+
+
+def choose_compression(name: str, input_file: str = None, plaintext: bytes = b'') -> str:
+    """
+    决定文件实际使用的压缩算法: 对开头 compression_sample_size 字节试压缩, 压缩率达不到 compression_min_ratio 时不压缩
+    :param name: 配置的压缩算法, none 表示不压缩
+    :return: 压缩算法名或 none
+    """
+    if name == 'none':
+        return 'none'
+    codec = get_codec(name)
+    sample_size = config.crypto.compression_sample_size
+    if input_file is None:
+        sample = plaintext[:sample_size]
+    else:
+        with open(input_file, 'rb') as f:
+            sample = f.read(sample_size)
+    if not sample:
+        return 'none'
+    compressor = codec.compressor()
+    compressed_size = len(compressor.compress(sample)) + len(compressor.flush())
+    return name if compressed_size <= len(sample) * config.crypto.compression_min_ratio else 'none'
+
+
+class CompressedReader(io.RawIOBase):
+    """把明文输入流包装为压缩数据输入流, readinto 除最后一次外总是填满缓冲区, 关闭时同时关闭原输入流"""
+
+    def __init__(self, src, codec: Codec, chunk_size: int):
+        self._src = src
+        self._compressor = codec.compressor()
+        self._chunk_size = chunk_size
+        self._pending = bytearray()
+        self._eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while len(self._pending) < len(b) and not self._eof:
+            data = self._src.read(self._chunk_size)
+            if data:
+                self._pending += self._compressor.compress(data)
+            else:
+                self._pending += self._compressor.flush()
+                self._eof = True
+        n = min(len(b), len(self._pending))
+        b[:n] = self._pending[:n]
+        del self._pending[:n]
+        return n
+
+    def close(self):
+        self._src.close()
+        super().close()
+
+
+class DecompressedWriter(object):
+    """把明文输出流包装为压缩数据输出流, 写入的压缩数据边解压边写入原输出流"""
+
+    def __init__(self, dst, codec: Codec):
+        self._dst = dst
+        self._codec = codec
+        self._decompressor = codec.decompressor()
+        self.written = 0  # 写入原输出流的明文字节数
+
+    def write(self, data) -> int:
+        for chunk in self._codec.decompress_chunks(self._decompressor, data):
+            self.written += self._dst.write(chunk)
+        return len(data)
+
+    def finish(self) -> int:
+        """检查压缩数据是否完整, 返回明文字节数"""
+        if not self._decompressor.eof:
+            raise ValueError("压缩数据不完整")
+        return self.written
+
+
+register_codec(ZlibCodec('zlib', lambda: zlib.compressobj(6), zlib.decompressobj))
+register_codec(LzmaCodec('lzma', lambda: lzma.LZMACompressor(preset=6), lzma.LZMADecompressor))
@@ -1,234 +1,493 @@
+import io
+import mmap
 import os
-import time
+import threading
+import traceback
+from contextlib import contextmanager
 from pathlib import Path
 
-from Crypto.Cipher import DES
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-
 from db_data.manager import db
-from module.common import create_dir_if_not_exists
+from module.cipher_registry import PADDING, CipherSpec, get_cipher
+from module.blob_apis import PackedBlob, atomic_write, blob_size, new_blob_path, open_blob, write_blob
+from module.compress_apis import CompressedReader, DecompressedWriter, get_codec
+from module.envelope_apis import file_key
+from module.segment_apis import (
+    decrypt_segment_range,
+    decrypt_segmented,
+    decrypt_segmented_view,
+    encrypt_segmented,
+    encrypt_segmented_view,
+    segmented_capacity,
+)
 from setting.config_loader import config
-from setting.global_variant import DELIMITER
-
-
-def encrypt_file_AES(input_file: str, username: str, filename: str, key: bytes, plaintext: str = '', file_path: Path = ''):
-    """使用 AES 加密文件"""
-    iv = os.urandom(16)  # 生成 16 字节的随机 IV
-    cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
-    encryptor = cipher.encryptor()
-
-    if not plaintext:
-        with open(input_file, 'rb') as f:
-            plaintext = f.read()
-
-    # PKCS7 填充
-    pad_len = 16 - (len(plaintext) % 16)
-    plaintext += bytes([pad_len] * pad_len)
-
-    ciphertext = encryptor.update(plaintext) + encryptor.finalize()
-
-    file_path = file_path or Path(config.path.upload) / username / (filename + str(time.time()))
-    create_dir_if_not_exists(file_path)
-    with open(file_path, 'wb') as f:
-        f.write(ciphertext)  # 存储密文
-    return iv, file_path
 
-
-def decrypt_file_AES(file_id: int, key: bytes):
-    """使用 AES 解密文件"""
-    file_dict = db.get_file_by_id(file_id)
-    with open(file_dict['file_path'], 'rb') as f:
-        data = f.read()
-
-    iv = file_dict['iv']  # 读取 IV
-    ciphertext = data
-
-    cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
-    decryptor = cipher.decryptor()
-
-    plaintext = decryptor.update(ciphertext) + decryptor.finalize()
+# 流式加解密的分块大小, 向下取整为16字节(AES/SM4分组长度)的倍数, 同时也是8字节的倍数
+CHUNK_SIZE = max(config.crypto.chunk_size // 16, 1) * 16
+
+
+def _chunk_size(spec: CipherSpec, data_size: int) -> int:
+    """分块大小, 不支持流式处理的后端一次性处理全部数据(向上取整为分组长度的倍数)"""
+    if spec.streaming:
+        return CHUNK_SIZE
+    return max(-(-data_size // spec.block_size), 1) * spec.block_size
+
+
+def _input_size(input_file, plaintext: bytes) -> int:
+    """明文长度, 输入为流(如管道)时长度未知, 返回0"""
+    if plaintext:
+        return len(plaintext)
+    if hasattr(input_file, 'read'):
+        return 0
+    return os.path.getsize(input_file)
+
+
+def _open_plaintext(input_file, plaintext: bytes, compression: str = 'none'):
+    """获取明文输入流, 传入明文时包装为内存流, 传入流时直接使用, 否则打开原文件, 需要压缩时再包装为压缩数据流"""
+    if plaintext:
+        src = io.BytesIO(plaintext)
+    elif hasattr(input_file, 'read'):
+        src = input_file
+    else:
+        src = open(input_file, 'rb')
+    if compression == 'none':
+        return src
+    return CompressedReader(src, get_codec(compression), CHUNK_SIZE)
+
+
+def _use_mmap(data_size: int) -> bool:
+    """根据I/O策略决定是否使用内存映射, 空文件无法映射"""
+    strategy = config.crypto.io_strategy
+    if data_size == 0 or strategy == 'buffered':
+        return False
+    return strategy == 'mmap' or data_size >= config.crypto.mmap_threshold
+
+
+@contextmanager
+def _release_on_error():
+    """异常栈帧会持有映射的切片, 导致映射无法关闭并掩盖原始异常, 抛出前先清理栈帧"""
+    try:
+        yield
+    except BaseException as e:
+        traceback.clear_frames(e.__traceback__)
+        raise
+
+
+@contextmanager
+def _map_input(path):
+    """只读映射输入文件, 返回 memoryview"""
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+        with _release_on_error():
+            yield view
+
+
+@contextmanager
+def _map_output(f, capacity: int):
+    """映射已打开的输出文件并预分配 capacity 字节, 调用方在映射释放后截断为实际长度"""
+    f.truncate(capacity)
+    with mmap.mmap(f.fileno(), capacity) as mapped, memoryview(mapped) as view:
+        with _release_on_error():
+            yield view
+
+
+def _stream_encrypt(ctx, src, dst, block_size: int, chunk_size: int = CHUNK_SIZE):
+    """
+    流式加密: 使用预分配的缓冲区分块读取(readinto)、加密(update_into)、写入, 仅在最后一块做PKCS7填充
+    稳态循环中不再按块分配内存
+    :param ctx: CBC加密上下文
+    :param src: 明文输入流
+    :param dst: 密文输出流
+    :param block_size: 分组长度
+    :param chunk_size: 分块大小, 需为分组长度的倍数
+    """
+    in_view = memoryview(bytearray(chunk_size + block_size))  # 多预留一个分组用于最后一块的填充
+    out_view = memoryview(bytearray(chunk_size + 2 * block_size))  # update_into 要求输出缓冲区不小于 输入长度+分组长度-1
+    chunk_view = in_view[:chunk_size]
+    while True:
+        n = src.readinto(chunk_view)
+        if n < chunk_size:
+            # 最后一块(可能为空), 原地追加 PKCS7 填充
+            pad_len = block_size - (n % block_size)
+            in_view[n : n + pad_len] = PADDING[pad_len]
+            dst.write(out_view[: ctx.update_into(in_view[: n + pad_len], out_view)])
+            dst.write(ctx.finalize())
+            return
+        dst.write(out_view[: ctx.update_into(chunk_view, out_view)])
+
+
+def _stream_decrypt(ctx, src, dst, block_size: int, chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    流式解密: 使用预分配的缓冲区边读边解密边写入, 只保留最后一个分组用于去除PKCS7填充
+    :param ctx: CBC解密上下文
+    :param src: 密文输入流
+    :param dst: 明文输出流
+    :param block_size: 分组长度
+    :param chunk_size: 分块大小, 需为分组长度的倍数
+    :return: 写入的明文字节数
+    """
+    in_view = memoryview(bytearray(chunk_size))
+    # 输出缓冲区开头存放上一轮保留的最后一个分组, 末尾预留 update_into 需要的额外空间
+    out_view = memoryview(bytearray(block_size + chunk_size + block_size))
+    written = tail = 0
+    while n := src.readinto(in_view):
+        total = tail + ctx.update_into(in_view[:n], out_view[tail:])
+        tail = min(block_size, total)  # 最后一个分组可能是填充, 暂不写入
+        written += dst.write(out_view[: total - tail])
+        out_view[:tail] = out_view[total - tail : total]
+    final = ctx.finalize()
+    out_view[tail : tail + len(final)] = final
+    tail += len(final)
 
     # 去除 PKCS7 填充
-    pad_len = plaintext[-1]
-    plaintext = plaintext[:-pad_len]
-
-    return plaintext
-
-
-def encrypt_file_SM4(input_file: str, username: str, filename: str, key: bytes, plaintext: str = '', file_path: Path = ''):
-    """使用 SM4 加密文件"""
-    iv = os.urandom(16)  # 生成 16 字节的随机 IV
-    cipher = Cipher(algorithms.SM4(key), modes.CBC(iv), backend=default_backend())
-    encryptor = cipher.encryptor()
-
-    if not plaintext:
-        with open(input_file, 'rb') as f:
-            plaintext = f.read()
-
-    # PKCS7 填充
-    pad_len = 16 - (len(plaintext) % 16)
-    plaintext += bytes([pad_len] * pad_len)
-
-    ciphertext = encryptor.update(plaintext) + encryptor.finalize()
-
-    file_path = file_path or Path(config.path.upload) / username / (filename + str(time.time()))
-    create_dir_if_not_exists(file_path)
-    with open(file_path, 'wb') as f:
-        f.write(ciphertext)  # 存储密文
-    return iv, file_path
-
-
-def decrypt_file_SM4(file_id: int, key: bytes):
-    """使用 SM4 解密文件"""
+    pad_len = out_view[tail - 1]
+    written += dst.write(out_view[: tail - pad_len])
+    return written
+
+
+def _view_encrypt(ctx, src_view, dst_view, block_size: int, chunk_size: int) -> int:
+    """
+    在内存映射视图之间加密, 由内核负责换页, 省去 read/write 的用户态拷贝
+    :param dst_view: 输出视图, 需比密文多预留一个分组供 update_into 使用
+    :return: 密文长度
+    """
+    full = len(src_view) // block_size * block_size
+    offset = size = 0
+    while offset < full:
+        end = min(offset + chunk_size, full)
+        size += ctx.update_into(src_view[offset:end], dst_view[size:])
+        offset = end
+    # 最后不足一个分组的部分和 PKCS7 填充拼接后加密
+    pad_len = block_size - (len(src_view) - full)
+    size += ctx.update_into(bytes(src_view[full:]) + PADDING[pad_len], dst_view[size:])
+    final = ctx.finalize()
+    dst_view[size : size + len(final)] = final
+    return size + len(final)
+
+
+def _view_decrypt(ctx, src_view, dst_view, block_size: int, chunk_size: int) -> int:
+    """
+    在内存映射视图之间解密
+    :param dst_view: 输出视图, 需比密文多预留一个分组供 update_into 使用
+    :return: 去除填充后的明文长度
+    """
+    offset = size = 0
+    while offset < len(src_view):
+        end = min(offset + chunk_size, len(src_view))
+        size += ctx.update_into(src_view[offset:end], dst_view[size:])
+        offset = end
+    final = ctx.finalize()
+    dst_view[size : size + len(final)] = final
+    size += len(final)
+    return size - dst_view[size - 1]  # 去除 PKCS7 填充
+
+
+def encrypt_file_cbc(
+    spec: CipherSpec, input_file: str, username: str, filename: str, key: bytes, plaintext: bytes = b'', file_path: Path = '', compression: str = 'none'
+):
+    """使用 CBC 模式流式加密文件(旧版整体密文格式), 返回 (IV, 密文路径, 密文摘要)"""
+    iv = os.urandom(spec.iv_size)  # 生成随机 IV
+    ctx = spec.new_cbc(key, iv)
+
+    file_path = file_path or new_blob_path(username, filename)
+    data_size = _input_size(input_file, plaintext)
+    chunk_size = _chunk_size(spec, data_size)
+    if not plaintext and compression == 'none' and not isinstance(file_path, PackedBlob) and _use_mmap(data_size):
+        with write_blob(file_path, 'w+b') as dst:
+            capacity = (data_size // spec.block_size + 2) * spec.block_size
+            with _map_input(input_file) as src_view, _map_output(dst, capacity) as dst_view:
+                size = _view_encrypt(ctx, src_view, dst_view, spec.block_size, chunk_size)
+                dst.update_digest(dst_view[:size])
+            dst.truncate(size)
+        return iv, file_path, dst.hexdigest()
+
+    with _open_plaintext(input_file, plaintext, compression) as src, write_blob(file_path) as dst:
+        _stream_encrypt(ctx, src, dst, spec.block_size, chunk_size)  # 流式存储密文
+    return iv, file_path, dst.hexdigest()
+
+
+def decrypt_file_cbc(spec: CipherSpec, file_dict: dict, key: bytes, dst) -> int:
+    """使用 CBC 模式流式解密文件到输出流, 返回写入字节数"""
+    ctx = spec.new_cbc(key, file_dict['iv'], decrypt=True)
+    data_size = blob_size(file_dict)
+    with open_blob(file_dict) as src:
+        return _stream_decrypt(ctx, src, dst, spec.block_size, _chunk_size(spec, data_size))
+
+
+def _parallel_workers(data_size: int) -> int:
+    """根据数据大小决定分段并行数, 小于阈值时保持单线程"""
+    if data_size < config.crypto.parallel_threshold:
+        return 1
+    return config.crypto.parallel_workers or os.cpu_count() or 1
+
+
+def encrypt_file_segmented(
+    spec: CipherSpec, input_file: str, username: str, filename: str, key: bytes, plaintext: bytes = b'', file_path: Path = '', compression: str = 'none'
+):
+    """使用分段格式加密文件, 每个分段独立加密认证, 支持随机读取, 返回 (None, 密文路径, 密文摘要)"""
+    file_path = file_path or new_blob_path(username, filename)
+    data_size = _input_size(input_file, plaintext)
+    segment_size = config.crypto.segment_size
+    workers = _parallel_workers(data_size)
+    if not plaintext and compression == 'none' and workers <= 1 and not isinstance(file_path, PackedBlob) and _use_mmap(data_size):
+        with write_blob(file_path, 'w+b') as dst:
+            capacity = segmented_capacity(spec.name, data_size, segment_size)
+            with _map_input(input_file) as src_view, _map_output(dst, capacity) as dst_view:
+                size = encrypt_segmented_view(spec.name, key, src_view, dst_view, segment_size)
+                dst.update_digest(dst_view[:size])
+            dst.truncate(size)
+        return None, file_path, dst.hexdigest()
+
+    with _open_plaintext(input_file, plaintext, compression) as src, write_blob(file_path) as dst:
+        encrypt_segmented(spec.name, key, src, dst, segment_size, workers, config.crypto.parallel_executor)
+    return None, file_path, dst.hexdigest()  # 分段格式的nonce保存在各分段中, 不需要单独的IV
+
+
+def _password_too_long(spec: CipherSpec) -> str:
+    return f"{spec.name}加密, 密码不能超过{spec.key_size}位"
+
+
+def encrypt_file(
+    algorithm: str,
+    input_file,
+    username,
+    file_name,
+    password,
+    plaintext: bytes = b'',
+    file_path: str = '',
+    blob_format: str = 'cbc',
+    compression: str = 'none',
+    data_key: bytes = None,
+):
+    # 根据注册表中的算法描述填充密码长度, 传入数据密钥时(信封加密)使用数据密钥加密内容, 否则直接使用填充后的密码
+    # 返回 (是否成功, IV, 密文路径, 填充后的密码, 密文摘要)
+    spec = get_cipher(algorithm)
+    if len(password) > spec.key_size:
+        return False, "错误", _password_too_long(spec), None, None
+    filled_password = spec.fill_password(password)
+
+    encrypt_func = encrypt_file_segmented if blob_format == 'segment' else encrypt_file_cbc
+    key = data_key or filled_password.encode('utf-8')
+    iv, fpath, digest = encrypt_func(spec, input_file, username, file_name, key, plaintext=plaintext, file_path=file_path, compression=compression)
+    return True, iv, fpath, filled_password, digest
+
+
+def _decrypt_to_stream(spec: CipherSpec, file_dict: dict, key: bytes, dst) -> int:
+    """按密文格式流式解密到输出流, 压缩过的文件同时流式解压, 返回写入的明文字节数"""
+    if file_dict['compression'] != 'none':
+        sink = DecompressedWriter(dst, get_codec(file_dict['compression']))
+        _decrypt_blob(spec, file_dict, key, sink)
+        return sink.finish()
+    return _decrypt_blob(spec, file_dict, key, dst)
+
+
+def _decrypt_blob(spec: CipherSpec, file_dict: dict, key: bytes, dst) -> int:
+    """按密文格式流式解密到输出流, 返回写入字节数"""
+    if file_dict['blob_format'] == 'segment':
+        workers = _parallel_workers(blob_size(file_dict))
+        with open_blob(file_dict) as src:
+            return decrypt_segmented(spec.name, key, src, dst, workers, config.crypto.parallel_executor)
+    return decrypt_file_cbc(spec, file_dict, key, dst)
+
+
+def _decrypt_to_path_mmap(spec: CipherSpec, file_dict: dict, key: bytes, dst) -> int:
+    """在密文和目标文件(以 w+b 打开)的内存映射之间解密, 返回写入字节数"""
+    data_size = os.path.getsize(file_dict['file_path'])
+    if file_dict['blob_format'] == 'segment':
+        with _map_input(file_dict['file_path']) as src_view, _map_output(dst, data_size + 32) as dst_view:
+            size = decrypt_segmented_view(spec.name, key, src_view, dst_view)
+    else:
+        ctx = spec.new_cbc(key, file_dict['iv'], decrypt=True)
+        with _map_input(file_dict['file_path']) as src_view, _map_output(dst, data_size + spec.block_size) as dst_view:
+            size = _view_decrypt(ctx, src_view, dst_view, spec.block_size, _chunk_size(spec, data_size))
+    dst.truncate(size)
+    return size
+
+
+def decrypt_file_to_stream(algorithm: str, password: str, file_id: int, dst):
+    """自适应流式解密到输出流, 返回写入字节数和填充后的密码"""
+    spec = get_cipher(algorithm)
+    filled_password = spec.fill_password(password)
     file_dict = db.get_file_by_id(file_id)
-    with open(file_dict['file_path'], 'rb') as f:
-        data = f.read()
-
-    iv = file_dict['iv']  # 读取 IV
-    ciphertext = data
-
-    cipher = Cipher(algorithms.SM4(key), modes.CBC(iv), backend=default_backend())
-    decryptor = cipher.decryptor()
-
-    plaintext = decryptor.update(ciphertext) + decryptor.finalize()
-
-    # 去除 PKCS7 填充
-    pad_len = plaintext[-1]
-    plaintext = plaintext[:-pad_len]
-
-    return plaintext
-
+    written = _decrypt_to_stream(spec, file_dict, file_key(file_dict, filled_password), dst)
+    return written, filled_password
 
-def encrypt_file_3DES(input_file: str, username: str, filename: str, key: bytes, plaintext: str = '', file_path: Path = ''):
-    """使用 3DES 加密文件"""
-    iv = os.urandom(8)  # 3DES IV 长度为 8 字节
-    cipher = Cipher(algorithms.TripleDES(key), modes.CBC(iv), backend=default_backend())
-    encryptor = cipher.encryptor()
 
-    if not plaintext:
-        with open(input_file, 'rb') as f:
-            plaintext = f.read()
-
-    # PKCS7 填充
-    pad_len = 8 - (len(plaintext) % 8)
-    plaintext += bytes([pad_len] * pad_len)
-
-    ciphertext = encryptor.update(plaintext) + encryptor.finalize()
-
-    file_path = file_path or Path(config.path.upload) / username / (filename + str(time.time()))
-    create_dir_if_not_exists(file_path)
-    with open(file_path, 'wb') as f:
-        f.write(ciphertext)  # 存储密文
-    return iv, file_path
-
-
-def decrypt_file_3DES(file_id: int, key: bytes):
-    """使用 3DES 解密文件"""
+def decrypt_file(algorithm: str, password: str, file_id: int):
+    # 自适应解密, 返回完整明文
+    buffer = io.BytesIO()
+    _, filled_password = decrypt_file_to_stream(algorithm, password, file_id, buffer)
+    return buffer.getvalue(), filled_password
+
+
+def decrypt_file_to_path(algorithm: str, password: str, file_id: int, path: Path) -> int:
+    """
+    解密文件写入目标路径, 内存占用与文件大小无关, 大文件按I/O策略使用内存映射, 返回写入字节数
+    先写入同目录的临时文件, 成功后才替换目标路径, 解密失败时目标路径上已有的文件保持不变
+    """
+    spec = get_cipher(algorithm)
     file_dict = db.get_file_by_id(file_id)
-    with open(file_dict['file_path'], 'rb') as f:
-        data = f.read()
-
-    iv = file_dict['iv']  # 读取 IV
-    ciphertext = data
-
-    cipher = Cipher(algorithms.TripleDES(key), modes.CBC(iv), backend=default_backend())
-    decryptor = cipher.decryptor()
-
-    plaintext = decryptor.update(ciphertext) + decryptor.finalize()
-
-    # 去除 PKCS7 填充
-    pad_len = plaintext[-1]
-    plaintext = plaintext[:-pad_len]
-
-    return plaintext
-
-
-def encrypt_file_DES(input_file: str, username: str, filename: str, key: bytes, plaintext: str = '', file_path: Path = ''):
-    """使用 DES 加密文件"""
-    iv = os.urandom(8)  # DES IV 长度为 8 字节
-    cipher = DES.new(key, DES.MODE_CBC, iv)
-
-    if not plaintext:
-        with open(input_file, 'rb') as f:
-            plaintext = f.read()
-
-    # PKCS7 填充
-    pad_len = 8 - (len(plaintext) % 8)
-    plaintext += bytes([pad_len] * pad_len)
-
-    ciphertext = cipher.encrypt(plaintext)
-
-    file_path = file_path or Path(config.path.upload) / username / (filename + str(time.time()))
-    create_dir_if_not_exists(file_path)
-    with open(file_path, 'wb') as f:
-        f.write(ciphertext)  # 存储密文
-    return iv, file_path
-
-
-def decrypt_file_DES(file_id: int, key: bytes):
-    """使用 DES 解密文件"""
+    key = file_key(file_dict, spec.fill_password(password))
+    size = blob_size(file_dict)
+    parallel = file_dict['blob_format'] == 'segment' and _parallel_workers(size) > 1
+    if not parallel and file_dict['compression'] == 'none' and not file_dict.get('pack_segment') and _use_mmap(size):
+        with atomic_write(path, 'w+b') as f:
+            return _decrypt_to_path_mmap(spec, file_dict, key, f)
+    with atomic_write(path) as f:
+        return _decrypt_to_stream(spec, file_dict, key, f)
+
+
+def _decrypt_range_cbc(file_dict: dict, key: bytes, offset: int, length: int) -> bytes:
+    """旧版CBC密文的随机读取: 解密第i个分组只需要第i-1个密文分组, 无需解密之前的全部内容"""
+    spec = get_cipher(file_dict['algorithm'])
+    block_size = spec.block_size
+    ciphertext_size = blob_size(file_dict)
+    start = offset // block_size * block_size
+    end = min(-(-(offset + length) // block_size) * block_size, ciphertext_size)
+    if length <= 0 or start >= ciphertext_size:
+        return b''
+
+    with open_blob(file_dict) as f:
+        if start:
+            f.seek(start - block_size)
+            iv = f.read(block_size)  # 前一个密文分组即为当前位置的IV
+        else:
+            iv = file_dict['iv']
+        ciphertext = f.read(end - start)
+    ctx = spec.new_cbc(key, iv, decrypt=True)
+    plaintext = ctx.update(ciphertext) + ctx.finalize()
+    if end == ciphertext_size:
+        plaintext = plaintext[: -plaintext[-1]]  # 读到文件末尾时去除 PKCS7 填充
+    return plaintext[offset - start : offset - start + length]
+
+
+class _RangeComplete(Exception):
+    """随机读取的范围已全部写入, 用于提前结束解密"""
+
+
+class _RangeSink(object):
+    """只保留 [offset, offset+length) 部分的输出流, 写满后抛出 _RangeComplete 提前结束解密"""
+
+    def __init__(self, offset: int, length: int):
+        self._start = offset
+        self._end = offset + length
+        self._position = 0
+        self.data = bytearray()
+
+    def write(self, data) -> int:
+        lo = max(self._start - self._position, 0)
+        hi = min(self._end - self._position, len(data))
+        if lo < hi:
+            self.data += data[lo:hi]
+        self._position += len(data)
+        if self._position >= self._end:
+            raise _RangeComplete()
+        return len(data)
+
+
+def decrypt_range(file_id: int, offset: int, length: int, password: str = '') -> bytes:
+    """
+    随机读取解密, 只解密 [offset, offset+length) 涉及到的分段, 耗时与读取长度成正比
+    压缩过的文件无法定位, 需要从头流式解密解压, 耗时与 offset+length 成正比, 因此 crypto.compression 默认不压缩
+    :param file_id: 文件id
+    :param offset: 明文偏移量
+    :param length: 读取长度
+    :param password: 文件密码, 不传时使用数据库中保存的密码
+    :return: 明文字节, 超出文件末尾的部分会被截断
+    """
     file_dict = db.get_file_by_id(file_id)
-    with open(file_dict['file_path'], 'rb') as f:
-        data = f.read()
-
-    iv = file_dict['iv']  # 读取 IV
-    ciphertext = data
+    spec = get_cipher(file_dict['algorithm'])
+    key = file_key(file_dict, spec.fill_password(password or file_dict['password']))
+    if length <= 0 or offset < 0:
+        return b''
+    if file_dict['compression'] != 'none':
+        # 压缩后明文偏移量与密文位置不再对应, 只能从头解密解压
+        sink = _RangeSink(offset, length)
+        try:
+            _decrypt_to_stream(spec, file_dict, key, sink)
+        except _RangeComplete:
+            pass
+        return bytes(sink.data)
+    if file_dict['blob_format'] == 'segment':
+        with open_blob(file_dict) as src:
+            return decrypt_segment_range(spec.name, key, src, offset, length)
+    return _decrypt_range_cbc(file_dict, key, offset, length)
+
+
+class StopRequested(Exception):
+    """stop_event 已设置, 中止进行中的重新加密"""
+
+
+class _ThrottledWriter(object):
+    """按写入的字节数限速的输出流, 每次写入前检查 stop_event"""
+
+    def __init__(self, dst, limiter, stop_event: threading.Event = None):
+        self._dst = dst
+        self._limiter = limiter
+        self._stop_event = stop_event
+
+    def write(self, data) -> int:
+        if self._stop_event is not None and self._stop_event.is_set():
+            raise StopRequested()
+        if self._limiter is not None:
+            self._limiter.acquire(len(data))
+        return self._dst.write(data)
+
+
+def reencrypt_file(
+    file_id: int,
+    algorithm: str,
+    password: str,
+    file_path: Path,
+    blob_format: str = 'cbc',
+    compression: str = 'none',
+    data_key: bytes = None,
+    limiter=None,
+    stop_event: threading.Event = None,
+):
+    """
+    将已有文件重新加密到新的密文文件, 不在内存中保留完整明文:
+    后台线程用原算法解密写入管道, 当前线程从管道读取并用新算法加密
+    :param file_id: 文件id
+    :param algorithm: 新的加密算法
+    :param password: 新的密码
+    :param file_path: 新密文的保存路径(或 PackedBlob), 不能与原密文相同
+    :param data_key: 新的数据密钥, 不传时使用填充后的密码作为密钥
+    :param limiter: 解密输出的限速(RateLimiter), 按块限速, 磁盘读写平稳
+    :param stop_event: 设置后在下一块中止, 抛出 StopRequested
+    :return: 与 encrypt_file 相同, 原密文解密失败时抛出异常
+    """
+    spec = get_cipher(algorithm)
+    if len(password) > spec.key_size:
+        return False, "错误", _password_too_long(spec), None, None  # 在启动解密线程前检查, 否则管道无人读取会阻塞
 
-    cipher = DES.new(key, DES.MODE_CBC, iv)
-    plaintext = cipher.decrypt(ciphertext)
-
-    # 去除 PKCS7 填充
-    pad_len = plaintext[-1]
-    plaintext = plaintext[:-pad_len]
-
-    return plaintext
-
-
-def encrypt_file(algorithm: str, input_file, username, file_name, password, plaintext: str = '', file_path: str = ''):
-    # 自适应加密算法填充密码长度
-    match algorithm:
-        case 'AES':
-            if len(password) > 32:
-                return False, "错误", "AES加密, 密码不能超过32位"
-            filled_password = password.rjust(32, DELIMITER)
-            iv, fpath = encrypt_file_AES(input_file, username, file_name, filled_password.encode('utf-8'), plaintext=plaintext, file_path=file_path)
-        case 'DES':
-            if len(password) > 8:
-                return False, "错误", "DES加密, 密码不能超过8位"
-            filled_password = password.rjust(8, DELIMITER)
-            iv, fpath = encrypt_file_DES(input_file, username, file_name, filled_password.encode('utf-8'), plaintext=plaintext, file_path=file_path)
-        case '3DES':
-            if len(password) > 8:
-                return False, "错误", "3DES加密, 密码不能超过8位"
-            filled_password = password.rjust(8, DELIMITER)
-            iv, fpath = encrypt_file_3DES(input_file, username, file_name, filled_password.encode('utf-8'), plaintext=plaintext, file_path=file_path)
-        case 'SM4':
-            if len(password) > 16:
-                return False, "错误", "SM4加密, 密码不能超过16位"
-            filled_password = password.rjust(16, DELIMITER)
-            iv, fpath = encrypt_file_SM4(input_file, username, file_name, filled_password.encode('utf-8'), plaintext=plaintext, file_path=file_path)
-    return True, iv, fpath, filled_password
-
-
-def decrypt_file(algorithm: str, password: str, file_id: int):
-    # 自适应解密
-    match algorithm:
-        case 'AES':
-            filled_password = password.rjust(32, DELIMITER)
-            decrypt_text = decrypt_file_AES(file_id, filled_password.encode('utf-8'))
-        case 'DES':
-            filled_password = password.rjust(8, DELIMITER)
-            decrypt_text = decrypt_file_DES(file_id, filled_password.encode('utf-8'))
-        case '3DES':
-            filled_password = password.rjust(8, DELIMITER)
-            decrypt_text = decrypt_file_3DES(file_id, filled_password.encode('utf-8'))
-        case 'SM4':
-            filled_password = password.rjust(16, DELIMITER)
-            decrypt_text = decrypt_file_SM4(file_id, filled_password.encode('utf-8'))
-    return decrypt_text, filled_password
+    file_dict = db.get_file_by_id(file_id)
+    old_spec = get_cipher(file_dict['algorithm'])
+    old_key = file_key(file_dict, file_dict['password'])
+    read_fd, write_fd = os.pipe()
+    errors = []
+
+    def produce():
+        try:
+            with open(write_fd, 'wb') as sink:
+                if limiter is not None or stop_event is not None:
+                    sink = _ThrottledWriter(sink, limiter, stop_event)
+                _decrypt_to_stream(old_spec, file_dict, old_key, sink)
+        except BaseException as e:  # 加密端提前关闭管道时这里会收到 BrokenPipeError
+            errors.append(e)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        with open(read_fd, 'rb') as src:
+            result = encrypt_file(
+                algorithm, src, None, None, password, file_path=file_path, blob_format=blob_format, compression=compression, data_key=data_key
+            )
+    finally:
+        producer.join()
+    if errors:
+        raise errors[0]
+    return result
 
 
 # 示例使用
 if __name__ == "__main__":
-    decrypt_file_AES(1, '123123'.rjust(32, '_').encode('utf-8'))
+    decrypt_file('AES', '123123', 1)
@@ -0,0 +1,92 @@
+"""
+信封加密
+
+每个文件使用随机生成的数据密钥加密内容, 数据库 sfg_encrypted_file.wrapped_key 中只保存用文件密码包装后的数据密钥:
+    包装密钥 = PBKDF2-HMAC-SHA256(填充后的密码, 随机盐, 迭代次数)
+    wrapped_key = 版本号(1字节) + 迭代次数(4字节) + 盐(16字节) + nonce(12字节) + AES-GCM(包装密钥, 数据密钥)
+修改密码只需要用新密码重新包装数据密钥, 耗时与文件大小无关.
+wrapped_key 为空的旧文件直接使用填充后的密码作为数据密钥, 修改密码时同样可以把它包装起来, 无需重写密文.
+"""
+
+import hashlib
+import os
+import struct
+from functools import lru_cache
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from module.cipher_registry import CipherSpec
+from setting.config_loader import config
+
+WRAP_VERSION = 1
+WRAP_HEADER = struct.Struct('>BI')  # 版本号, PBKDF2迭代次数
+SALT_SIZE = 16
+NONCE_SIZE = 12
+WRAP_AAD = b'SFG-DATA-KEY'
+
+
+@lru_cache(maxsize=256)
+def _derive_kek(password: str, salt: bytes, iterations: int) -> bytes:
+    """由密码派生包装密钥, 同一文件反复下载时不重复计算"""
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+
+
+def new_data_key(spec: CipherSpec) -> bytes:
+    """生成随机数据密钥, 长度与算法密钥长度一致"""
+    return os.urandom(spec.key_size)
+
+
+def new_salt() -> bytes:
+    return os.urandom(SALT_SIZE)
+
+
+def wrap_key(data_key: bytes, password: str, salt: bytes = None) -> bytes:
+    """
+    用密码包装数据密钥
+    :param data_key: 数据密钥
+    :param password: 填充后的文件密码
+    :param salt: 派生包装密钥的盐, 不传时随机生成; 批量包装时共用同一个盐可以只派生一次包装密钥
+    """
+    iterations = config.crypto.kdf_iterations
+    salt, nonce = salt or new_salt(), os.urandom(NONCE_SIZE)
+    header = WRAP_HEADER.pack(WRAP_VERSION, iterations)
+    return header + salt + nonce + AESGCM(_derive_kek(password, salt, iterations)).encrypt(nonce, data_key, WRAP_AAD + header)
+
+
+def unwrap_key(wrapped: bytes, password: str) -> bytes:
+    """
+    用密码解开数据密钥, 密码错误或数据被篡改时抛出 InvalidTag
+    :param wrapped: 包装后的数据密钥
+    :param password: 填充后的文件密码
+    """
+    header = bytes(wrapped[: WRAP_HEADER.size])
+    version, iterations = WRAP_HEADER.unpack(header)
+    if version != WRAP_VERSION:
+        raise ValueError(f"不支持的密钥包装版本 {version}")
+    salt = wrapped[WRAP_HEADER.size : WRAP_HEADER.size + SALT_SIZE]
+    nonce = wrapped[WRAP_HEADER.size + SALT_SIZE : WRAP_HEADER.size + SALT_SIZE + NONCE_SIZE]
+    ciphertext = wrapped[WRAP_HEADER.size + SALT_SIZE + NONCE_SIZE :]
+    return AESGCM(_derive_kek(password, bytes(salt), iterations)).decrypt(bytes(nonce), bytes(ciphertext), WRAP_AAD + header)
+
+
+def file_key(file_dict: dict, password: str) -> bytes:
+    """
+    获取文件内容的加密密钥
+    :param file_dict: 数据库中的文件记录
+    :param password: 填充后的文件密码
+    """
+    if file_dict.get('wrapped_key'):
+        return unwrap_key(file_dict['wrapped_key'], password)
+    return password.encode('utf-8')  # 旧文件直接使用密码作为密钥
+
+
+def rewrap_file_key(file_dict: dict, password: str, salt: bytes = None) -> bytes:
+    """
+    用新密码重新包装文件的数据密钥, 不读写密文
+    :param file_dict: 数据库中的文件记录(使用其中保存的原密码解开数据密钥)
+    :param password: 填充后的新密码
+    :param salt: 同 wrap_key
+    :return: 新的 wrapped_key
+    """
+    return wrap_key(file_key(file_dict, file_dict['password']), password, salt)
+
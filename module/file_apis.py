@@ -1,9 +1,13 @@
 from pathlib import Path
 
 from db_data.manager import db
+from module.blob_apis import blob_location, discard_blob, new_blob_target, remove_blob
+from module.cipher_registry import get_cipher
 from module.common import get_password_hash, verify_password
-from module.encrypt_apis import decrypt_file, encrypt_file
-from setting.global_variant import DELIMITER
+from module.compress_apis import choose_compression
+from module.encrypt_apis import StopRequested, decrypt_file_to_path, decrypt_range, encrypt_file, reencrypt_file
+from module.envelope_apis import new_data_key, new_salt, rewrap_file_key, wrap_key
+from setting.config_loader import config
 
 
 def file_upload(selected_algorithm: str, filename: str, password: str, selected_file: str, username: str):
@@ -14,23 +18,99 @@ def file_upload(selected_algorithm: str, filename: str, password: str, selected_
     if not password:
         return False, "请输入加密密码！"
 
+    result = _encrypt_upload(selected_algorithm, filename, password, selected_file, username)
+    if not result[0]:
+        return result
+    db.upload_file(**result[1])
+    return True, f"上传文件{filename}, {selected_algorithm}加密成功"
+
+
+def file_upload_bulk(files: list, username: str, batch_size: int = None) -> list:
+    """
+    批量上传文件, 逐个加密后每 batch_size 个文件写入一次数据库, 导入速度取决于加密而不是数据库提交
+    :param files: (加密算法, 文件名, 密码, 本地文件路径) 列表
+    :param username: 上传用户
+    :param batch_size: 每次写入数据库的文件数, 默认 database.bulk_batch
+    :return: 与 files 顺序一致的 (是否成功, 提示信息, 文件id) 列表, 失败时文件id为 None
+    """
+    batch_size = batch_size or config.database.bulk_batch
+    results, pending = [], []  # pending: (结果下标, 数据库记录, 密文写入位置)
+    for selected_algorithm, filename, password, selected_file in files:
+        if not selected_file or not password:
+            results.append((False, "请先选择文件！" if not selected_file else "请输入加密密码！", None))
+            continue
+        try:
+            result = _encrypt_upload(selected_algorithm, filename, password, selected_file, username)
+        except (OSError, ValueError) as e:
+            # 文件不存在、算法不支持或上传目录空间不足时只跳过这个文件, 前面已加密的文件照常写入数据库
+            results.append((False, f"上传文件{filename}失败: {e}", None))
+            continue
+        if not result[0]:
+            results.append((False, result[2], None))
+            continue
+        results.append(None)
+        pending.append((len(results) - 1, result[1], result[2]))
+        if len(pending) >= batch_size:
+            _save_uploads(pending, results)
+            pending = []
+    _save_uploads(pending, results)
+    return results
+
+
+def _encrypt_upload(selected_algorithm: str, filename: str, password: str, selected_file: str, username: str) -> tuple:
+    """
+    加密待上传的文件
+    :return: 成功时返回 (True, 数据库记录, 密文写入位置), 记录的字段与 DBManager.upload_file 的参数相同; 失败时返回 encrypt_file 的错误信息
+    """
     file_size = Path(selected_file).stat().st_size
 
-    is_success, iv_or_title, file_path_or_message, filled_password = encrypt_file(selected_algorithm, selected_file, username, filename, password)
-    if is_success:
-        db.upload_file(
-            filled_password,
-            get_password_hash(filled_password),
-            iv_or_title,
-            username,
-            file_path_or_message.as_posix(),
-            selected_algorithm,
-            file_size,
-            filename,
-        )
-        return True, f"上传文件{filename}, {selected_algorithm}加密成功"
-    else:
+    blob_format = config.crypto.blob_format
+    compression = choose_compression(config.crypto.compression, selected_file)
+    data_key = new_data_key(get_cipher(selected_algorithm))  # 信封加密: 内容使用随机数据密钥加密
+    target = new_blob_target(username, filename, file_size)
+    is_success, iv_or_title, file_path_or_message, filled_password, digest = encrypt_file(
+        selected_algorithm,
+        selected_file,
+        username,
+        filename,
+        password,
+        file_path=target,
+        blob_format=blob_format,
+        compression=compression,
+        data_key=data_key,
+    )
+    if not is_success:
         return False, iv_or_title, file_path_or_message
+    file_path, blob_root, pack_location = blob_location(file_path_or_message)
+    record = {
+        'password': filled_password,
+        'password_hash': get_password_hash(filled_password),
+        'iv': iv_or_title,
+        'username': username,
+        'file_path': file_path,
+        'algorithm': selected_algorithm,
+        'file_size': file_size,
+        'file_name': filename,
+        'blob_format': blob_format,
+        'compression': compression,
+        'wrapped_key': wrap_key(data_key, filled_password),
+        'blob_digest': digest,
+        'pack_location': pack_location,
+        'blob_root': blob_root,
+    }
+    return True, record, file_path_or_message
+
+
+def _save_uploads(pending: list, results: list):
+    """把一批已加密文件的记录写入数据库, 写入失败的文件清理密文"""
+    if not pending:
+        return
+    file_ids = db.upload_files_bulk([record for _, record, _ in pending], len(pending))
+    for (index, record, target), file_id in zip(pending, file_ids):
+        results[index] = (True, f"上传文件{record['file_name']}, {record['algorithm']}加密成功", file_id)
+    for index, record, target in pending[len(file_ids) :]:
+        discard_blob(target)
+        results[index] = (False, f"上传文件{record['file_name']}失败, 写入数据库出错", None)
 
 
 def file_edit(password: str, file_id: int, selected_algorithm: str, username: str, filename: str):
@@ -38,28 +118,129 @@ def file_edit(password: str, file_id: int, selected_algorithm: str, username: st
     if not password:
         return False, "请输入加密密码！"
 
+    spec = get_cipher(selected_algorithm)
+    if len(password) > spec.key_size:
+        return False, f"{selected_algorithm}加密, 密码不能超过{spec.key_size}位"
+
     org_file = db.get_file_by_id(file_id)
-    # 解密原本的加密文件
-    decrypt_text, _ = decrypt_file(org_file['algorithm'], org_file['password'], file_id)
+    if selected_algorithm == org_file['algorithm']:
+        # 算法没有变化, 不读写密文: 只改文件名时直接更新, 修改密码时用新密码重新包装数据密钥
+        params, expected = {'file_name': filename}, None
+        filled_password = spec.fill_password(password)
+        if filled_password != org_file['password']:
+            params.update(
+                password=filled_password,
+                password_hash=get_password_hash(filled_password),
+                wrapped_key=rewrap_file_key(org_file, filled_password),
+            )
+            # 包装的是读取时的数据密钥, 期间被重新加密或修改过密码时放弃更新
+            expected = {key: org_file[key] for key in ('file_path', 'wrapped_key', 'password')}
+        if not db.update_file_info(file_id, params, expected):
+            return False, "文件已被其他操作修改, 请刷新后重试"
+        return True, f"更新文件{filename}-{selected_algorithm}加密成功"
 
-    # 以新的加密算法重新加密文件
-    is_success, iv_or_title, file_path_or_message, filled_password = encrypt_file(
-        selected_algorithm,
-        None,
-        username,
-        filename,
-        password,
-        plaintext=decrypt_text,
-        file_path=org_file['file_path'],
-    )
+    return rekey_file(org_file, selected_algorithm, password, filename)
+
+
+def rekey_file(org_file: dict, algorithm: str, password: str, filename: str, limiter=None, stop_event=None) -> tuple:
+    """
+    以新的加密算法流式重新加密到新的密文文件, 数据库指向新文件后再删除原密文, 过程中原密文始终完整可用
+    期间文件被其他操作重新加密或修改密码时放弃本次结果, 不覆盖其他操作的修改
+    :param org_file: 数据库中的文件记录
+    :param algorithm: 新的加密算法
+    :param password: 新的密码(未填充)
+    :param filename: 新的文件名
+    :param limiter: 同 reencrypt_file
+    :param stop_event: 同 reencrypt_file, 中止时返回失败
+    """
+    new_path = new_blob_target(org_file['user_name'], filename, org_file['file_size'] or 0)
+    try:
+        sample = decrypt_range(org_file['id'], 0, config.crypto.compression_sample_size)
+        compression = choose_compression(config.crypto.compression, plaintext=sample)
+        data_key = new_data_key(get_cipher(algorithm))
+        is_success, iv_or_title, file_path_or_message, filled_password, digest = reencrypt_file(
+            org_file['id'],
+            algorithm,
+            password,
+            new_path,
+            blob_format=config.crypto.blob_format,
+            compression=compression,
+            data_key=data_key,
+            limiter=limiter,
+            stop_event=stop_event,
+        )
+    except StopRequested:
+        discard_blob(new_path)  # 按要求中止, 不是错误
+        return False, "重新加密已停止"
+    except Exception:
+        from traceback import print_exc
+
+        print_exc()
+        discard_blob(new_path)  # 清理写入一半的文件
+        return False, "重新加密失败"
     if is_success:
         # 更新信息提交到数据库
-        db.edit_file(file_id, filled_password, get_password_hash(filled_password), iv_or_title, selected_algorithm, filename)
-        return True, f"更新文件{filename}-{selected_algorithm}加密成功"
+        file_path, blob_root, pack_location = blob_location(file_path_or_message)
+        updated = db.edit_file(
+            org_file['id'],
+            filled_password,
+            get_password_hash(filled_password),
+            iv_or_title,
+            algorithm,
+            filename,
+            file_path,
+            config.crypto.blob_format,
+            compression,
+            wrap_key(data_key, filled_password),
+            digest,
+            pack_location,
+            blob_root,
+            expected={key: org_file[key] for key in ('file_path', 'wrapped_key', 'password')},
+        )
+        if not updated:
+            discard_blob(file_path_or_message)
+            return False, "文件已被其他操作修改, 请刷新后重试"
+        remove_blob(org_file)
+        return True, f"更新文件{filename}-{algorithm}加密成功"
     else:
         return False, file_path_or_message
 
 
+def rotate_file_passwords(current_user: dict, files: list, password: str) -> tuple:
+    """
+    批量修改文件密码, 只重新包装数据密钥, 不读写密文, 耗时与文件大小无关
+    同一批次中相同的填充密码共用密码哈希和盐, 只派生一次包装密钥, 数据库在一个事务中批量更新
+    """
+    if not password:
+        return False, "请输入加密密码！"
+    if current_user['role'] != 'admin' and any(file['user_name'] != current_user['username'] for file in files):
+        return False, "用户只能修改自己上传的文件"
+
+    files = list({file['id']: file for file in files}.values())  # 同一文件只修改一次
+    hashes, salts, updates = {}, {}, []
+    for file in files:
+        # 调用方传入的记录可能已过期(如已被重新加密), 使用数据库中的最新记录解开数据密钥
+        file = db.get_file_by_id(file['id'])
+        if not file:
+            continue
+        if current_user['role'] != 'admin' and file['user_name'] != current_user['username']:
+            return False, "用户只能修改自己上传的文件"
+        spec = get_cipher(file['algorithm'])
+        if len(password) > spec.key_size:
+            return False, f"{file['file_name']} 使用{spec.name}加密, 密码不能超过{spec.key_size}位"
+        filled_password = spec.fill_password(password)
+        if filled_password not in hashes:
+            hashes[filled_password] = get_password_hash(filled_password)
+            salts[filled_password] = new_salt()
+        wrapped_key = rewrap_file_key(file, filled_password, salts[filled_password])
+        updates.append((filled_password, hashes[filled_password], wrapped_key, file['id'], file['file_path'], file['wrapped_key'], file['password']))
+    updated = db.update_file_keys(updates)
+    failed = len(files) - len(updated)
+    if failed:
+        return False, f"{len(updated)}个文件修改密码成功, {failed}个文件已被删除或正在被其他操作修改, 请刷新后重试"
+    return True, f"{len(updated)}个文件修改密码成功"
+
+
 def varify_file_password(file: str, password: str):
     """校验文件密码"""
     if not file:
@@ -67,15 +248,7 @@ def varify_file_password(file: str, password: str):
     if not password:
         return False, "请输入加密密码！"
 
-    match file['algorithm']:
-        case 'AES':
-            filled_password = password.rjust(32, DELIMITER)
-        case 'DES':
-            filled_password = password.rjust(8, DELIMITER)
-        case '3DES':
-            filled_password = password.rjust(8, DELIMITER)
-        case 'SM4':
-            filled_password = password.rjust(16, DELIMITER)
+    filled_password = get_cipher(file['algorithm']).fill_password(password)
     if verify_password(filled_password, file['password_hash']):
         return True, "解密成功"
     else:
@@ -90,6 +263,19 @@ def get_file_list(current_user: dict, query: str = '') -> list:
     return db.get_file_list(params, query)
 
 
+def get_file_page(
+    current_user: dict, query: str = '', cursor: str = None, page_size: int = None, sort: str = 'file_name', direction: str = 'asc', with_total: bool = False
+) -> dict:
+    """
+    分页查找文件列表, 参数和返回值见 DBManager.get_file_page
+    :param cursor: 上一页返回的 next_cursor, 为空表示第一页
+    """
+    params = {}
+    if current_user['role'] != 'admin':
+        params['user_name'] = current_user['username']
+    return db.get_file_page(params, query, page_size, sort, direction, cursor, with_total)
+
+
 def delete_file(current_user: dict, file: dict) -> bool:
     if current_user['role'] != 'admin':
         if file['user_name'] != current_user['username']:
@@ -101,9 +287,8 @@ def delete_file(current_user: dict, file: dict) -> bool:
 def download_file(file: dict, password: str, path: Path) -> tuple:
     """保存文件到指定位置"""
     try:
-        decrypt_text, _ = decrypt_file(file['algorithm'], password, file['id'])
-        with open(path, 'wb') as f:
-            f.write(decrypt_text)
+        # 边解密边写入临时文件, 不在内存中保留完整明文, 失败时临时文件已删除, 目标路径不受影响
+        decrypt_file_to_path(file['algorithm'], password, file['id'], path)
         return True, f'下载成功, 保存位置{path}'
     except:
         from traceback import print_exc
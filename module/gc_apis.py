@@ -0,0 +1,116 @@
+"""
+回收孤立密文
+
+删除文件或用户只删除数据库记录, 密文仍留在上传目录中. 回收分两步:
+    标记: 先列出所有上传目录下符合密文命名的文件及其临时文件(见 is_blob_name), 再一次性读取数据库中引用的密文路径集合
+    清理: 不在集合中的文件即为孤立密文, 按批删除或移动到隔离目录(config.path.quarantine)
+先列目录再读数据库, 列目录之后才提交的上传一定在集合中; 已写入密文但尚未提交数据库的上传,
+以及正在写入的临时文件, 修改时间都在 crypto.gc_grace_period 以内, 会被跳过, 因此可以在上传的同时运行.
+临时文件不会被数据库引用, 崩溃后残留的临时文件超过宽限期后与孤立密文一起回收; .gitkeep 等不符合密文命名的文件不会被回收.
+
+用法:
+    python -m module.gc_apis --dry-run        # 只列出孤立密文
+    python -m module.gc_apis --quarantine     # 移动到隔离目录, 确认无误后再手动删除
+    python -m module.gc_apis                  # 直接删除
+"""
+
+import argparse
+import os
+import shutil
+import time
+from pathlib import Path
+
+from db_data.manager import db
+from module.blob_apis import is_blob_name, is_temp_blob_name, upload_roots
+from setting.config_loader import config
+
+
+def _normalize(path) -> str:
+    """统一路径写法, 数据库中的相对路径与遍历目录得到的路径可以直接比较"""
+    return os.path.normcase(os.path.abspath(path))
+
+
+def _list_blobs(root: Path):
+    """遍历上传目录, 返回符合密文命名的文件和写入密文的临时文件 (路径, 大小, 修改时间)"""
+    for dir_path, _, file_names in os.walk(root):
+        for file_name in file_names:
+            path = os.path.join(dir_path, file_name)
+            relative_path = os.path.relpath(path, root)
+            if not (is_blob_name(relative_path) or is_temp_blob_name(relative_path)):
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue  # 遍历过程中被删除或替换
+            yield path, stat.st_size, stat.st_mtime
+
+
+def _remove_blob(path: str, root: Path, quarantine: Path = None):
+    if quarantine is None:
+        os.remove(path)
+        return
+    target = quarantine / os.path.relpath(path, root)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    shutil.move(path, target)
+
+
+def collect_garbage(dry_run: bool = False, quarantine: bool = False, grace_period: float = None, batch_size: int = None) -> dict:
+    """
+    回收上传目录中没有被数据库引用的密文
+    :param dry_run: 只统计不删除
+    :param quarantine: 移动到隔离目录而不是删除
+    :param grace_period: 跳过修改时间在该秒数以内的文件, 默认 crypto.gc_grace_period
+    :param batch_size: 每批处理的文件数, 默认 crypto.gc_batch
+    :return: 统计结果, orphans 为孤立密文路径列表
+    """
+    grace_period = config.crypto.gc_grace_period if grace_period is None else grace_period
+    batch_size = batch_size or config.crypto.gc_batch
+    quarantine_root = Path(config.path.quarantine) if quarantine else None
+    started = time.time()
+
+    # 标记: 必须先列目录再读数据库, 见模块说明
+    blobs = [(root, *blob) for root, _ in upload_roots() if Path(root).exists() for blob in _list_blobs(Path(root))]
+    referenced = {_normalize(path) for path in db.get_blob_paths()}
+
+    summary = {'scanned': len(blobs), 'orphans': [], 'orphan_bytes': 0, 'recent': 0, 'removed': 0, 'failed': 0, 'dry_run': dry_run}
+    orphans = []
+    for root, path, size, mtime in blobs:
+        if _normalize(path) in referenced:
+            continue
+        if started - mtime < grace_period:
+            summary['recent'] += 1
+            continue
+        orphans.append((root, path))
+        summary['orphans'].append(path)
+        summary['orphan_bytes'] += size
+    if dry_run:
+        return summary
+
+    # 清理
+    for start in range(0, len(orphans), batch_size):
+        for root, path in orphans[start : start + batch_size]:
+            try:
+                _remove_blob(path, root, quarantine_root)
+                summary['removed'] += 1
+            except OSError as e:
+                summary['failed'] += 1
+                print(f"回收{path}失败: {e}")
+        print(f"回收孤立密文: 已处理{min(start + batch_size, len(orphans))}/{len(orphans)}个")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="回收孤立密文")
+    parser.add_argument('--dry-run', action='store_true', help="只列出孤立密文, 不删除")
+    parser.add_argument('--quarantine', action='store_true', help="移动到隔离目录而不是删除")
+    parser.add_argument('--grace', type=float, default=None, help="跳过最近修改过的文件(秒)")
+    parser.add_argument('--batch', type=int, default=None, help="每批处理的文件数")
+    args = parser.parse_args()
+
+    result = collect_garbage(args.dry_run, args.quarantine, args.grace, args.batch)
+    for orphan in result['orphans'] if args.dry_run else []:
+        print(orphan)
+    print(
+        f"扫描{result['scanned']}个文件, 孤立密文{len(result['orphans'])}个({result['orphan_bytes'] / 1024 / 1024:.1f}MB), "
+        f"跳过最近修改的{result['recent']}个, 已回收{result['removed']}个, 失败{result['failed']}个"
+    )
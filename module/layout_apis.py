@@ -0,0 +1,88 @@
+"""
+迁移密文存储布局
+
+按文件id顺序分批处理不在目标布局中的密文, 每个文件:
+    1. 在新路径创建硬链接(不支持硬链接时复制)
+    2. 整批在一个事务中把 file_path 改为新路径
+    3. 删除原路径
+任意一步中断, 数据库指向的路径都是完整的密文; 残留的新链接或原文件没有被引用, 由 module.gc_apis 回收.
+迁移过程中被重新加密或删除的文件, 数据库中的路径已经变化, 不会被改回, 新建的链接随即删除.
+存放在 pack 文件中的小文件不受存储布局影响, 直接跳过.
+
+用法:
+    python -m module.layout_apis                 # 迁移到 crypto.blob_layout
+    python -m module.layout_apis --layout user   # 迁移回旧版布局
+"""
+
+import argparse
+import os
+import shutil
+from pathlib import Path
+
+from db_data.manager import db
+from module.blob_apis import blob_layout, new_blob_path, root_of
+from setting.config_loader import config
+
+
+def _link_blob(src: str, dst: Path):
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)  # 跨磁盘或文件系统不支持硬链接
+    # 硬链接和复制都保留原密文的修改时间, 提交数据库之前新路径不在引用集合中,
+    # 更新修改时间使其处于 gc 的宽限期内, 避免迁移的同时运行 gc 删除新路径
+    os.utime(dst)
+
+
+def migrate_layout(layout: str = None, batch_size: int = None) -> dict:
+    """
+    把已有密文迁移到指定的存储布局
+    :param layout: 目标布局, 默认 crypto.blob_layout
+    :param batch_size: 每批移动并提交的文件数, 默认 crypto.layout_batch
+    :return: 统计结果
+    """
+    layout = layout or config.crypto.blob_layout
+    batch_size = batch_size or config.crypto.layout_batch
+    new_blob_path('', '', layout, config.path.upload)  # 校验布局名
+    summary = {'moved': 0, 'skipped': 0, 'missing': 0, 'changed': 0}
+    cursor = 0
+    while files := db.get_files_after(cursor, batch_size):
+        cursor = files[-1]['id']
+        moves = []
+        for file_dict in files:
+            if file_dict['pack_segment'] or blob_layout(file_dict['file_path']) == layout:
+                summary['skipped'] += 1
+                continue
+            # 在原上传目录中移动, 不跨磁盘
+            root = file_dict['blob_root'] or root_of(file_dict['file_path']) or config.path.upload
+            new_path = new_blob_path(file_dict['user_name'], file_dict['file_name'], layout, root)
+            try:
+                _link_blob(file_dict['file_path'], new_path)
+            except FileNotFoundError:
+                summary['missing'] += 1
+                continue
+            moves.append((file_dict['id'], file_dict['file_path'], new_path, root))
+
+        moved = set(db.move_blob_paths([(file_id, old_path, new_path.as_posix(), root) for file_id, old_path, new_path, root in moves]))
+        for file_id, old_path, new_path, _ in moves:
+            if file_id in moved:
+                Path(old_path).unlink(missing_ok=True)
+                summary['moved'] += 1
+            else:
+                new_path.unlink(missing_ok=True)
+                summary['changed'] += 1
+        print(f"迁移存储布局: 已处理到文件{cursor}, 移动{summary['moved']}个")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="迁移密文存储布局")
+    parser.add_argument('--layout', default=None, choices=['hash', 'user'], help="目标布局, 默认使用配置文件中的 crypto.blob_layout")
+    parser.add_argument('--batch', type=int, default=None, help="每批移动并提交的文件数")
+    args = parser.parse_args()
+
+    result = migrate_layout(args.layout, args.batch)
+    print(
+        f"移动{result['moved']}个文件, 已是目标布局{result['skipped']}个, 密文丢失{result['missing']}个, 迁移中被修改{result['changed']}个"
+    )
@@ -0,0 +1,126 @@
+"""
+整理 pack 文件
+
+删除或重新加密 pack 文件中的小文件只修改数据库, 原密文仍占用 pack 文件的空间.
+已封存的 pack 文件中不再被引用的内容超过 crypto.pack_compact_ratio 时, 把其中仍被引用的密文追加到当前的 pack 文件,
+逐个修改数据库中的位置, 全部移走后删除原 pack 文件. 修改位置前新位置已经写入, 任意时刻中断都不会丢失密文,
+中断后残留的重复内容在下次整理时回收. 正在写入的 pack 文件不整理.
+
+用法:
+    python -m module.pack_apis             # 持续运行, 每 crypto.pack_compact_interval 秒整理一次
+    python -m module.pack_apis --once      # 只整理一次
+    python -m module.pack_apis --stats     # 查看各 pack 文件的使用率
+"""
+
+import argparse
+import os
+import threading
+from pathlib import Path
+
+from db_data.manager import db
+from module.blob_apis import append_pack, flush_blobs, read_packed
+from setting.config_loader import config
+
+
+def pack_stats() -> list:
+    """各 pack 文件的长度、仍被引用的字节数和可回收比例"""
+    stats = []
+    for segment in db.get_pack_segments():
+        try:
+            segment['size'] = os.path.getsize(segment['file_path'])
+        except FileNotFoundError:
+            segment['size'] = 0
+        segment['dead_ratio'] = 1 - segment['live_bytes'] / segment['size'] if segment['size'] else 1.0
+        stats.append(segment)
+    return stats
+
+
+def compact_segment(segment: dict) -> dict:
+    """
+    把 pack 文件中仍被引用的密文移到当前的 pack 文件, 全部移走后删除原文件
+    :return: 统计结果
+    """
+    summary = {'moved': 0, 'moved_bytes': 0, 'changed': 0, 'removed': False}
+    for file_dict in db.get_packed_files(segment['id']):
+        file_path, location = append_pack(read_packed(file_dict))
+        if db.move_packed_file(file_dict, file_path, location):
+            summary['moved'] += 1
+            summary['moved_bytes'] += location[2]
+        else:
+            summary['changed'] += 1  # 整理过程中被重新加密或删除, 追加的内容在下次整理时回收
+    flush_blobs()  # batch 落盘策略下, 删除原文件前保证新位置已经落盘
+    if db.delete_pack_segment(segment['id']):
+        Path(segment['file_path']).unlink(missing_ok=True)
+        summary['removed'] = True
+    return summary
+
+
+def compact_packs(ratio: float = None, stop_event: threading.Event = None) -> dict:
+    """
+    整理可回收比例超过 ratio 的已封存 pack 文件
+    :param ratio: 默认 crypto.pack_compact_ratio
+    :param stop_event: 设置后整理完当前 pack 文件即返回
+    :return: 统计结果
+    """
+    ratio = config.crypto.pack_compact_ratio if ratio is None else ratio
+    summary = {'segments': 0, 'moved': 0, 'moved_bytes': 0, 'reclaimed_bytes': 0, 'failed': 0}
+    for segment in pack_stats():
+        if stop_event and stop_event.is_set():
+            break
+        if not segment['sealed'] or segment['dead_ratio'] < ratio:
+            continue
+        try:
+            result = compact_segment(segment)
+        except OSError as e:
+            # pack 文件丢失或损坏时仍有记录引用, 跳过这个文件继续整理其他文件, 丢失的密文由后台校验报告
+            summary['failed'] += 1
+            print(f"整理 pack 文件{segment['id']}失败: {e}")
+            continue
+        summary['segments'] += 1
+        summary['moved'] += result['moved']
+        summary['moved_bytes'] += result['moved_bytes']
+        if result['removed']:
+            summary['reclaimed_bytes'] += segment['size'] - result['moved_bytes']
+        print(f"整理 pack 文件{segment['id']}: 移动{result['moved']}个文件, {'已删除' if result['removed'] else '仍有文件引用, 保留'}")
+    return summary
+
+
+def run_compactor(interval: float = None, ratio: float = None, stop_event: threading.Event = None):
+    """
+    持续在后台整理 pack 文件
+    :param interval: 整理间隔(秒), 默认 crypto.pack_compact_interval
+    :param ratio: 同 compact_packs
+    :param stop_event: 设置后结束运行
+    """
+    interval = interval or config.crypto.pack_compact_interval
+    stop_event = stop_event or threading.Event()
+    while not stop_event.is_set():
+        summary = compact_packs(ratio, stop_event)
+        if summary['segments']:
+            print(f"整理 pack 文件: 整理{summary['segments']}个, 回收{summary['reclaimed_bytes'] / 1024 / 1024:.1f}MB")
+        if summary['failed']:
+            print(f"整理 pack 文件: {summary['failed']}个失败")
+        stop_event.wait(interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="整理 pack 文件")
+    parser.add_argument('--once', action='store_true', help="只整理一次")
+    parser.add_argument('--stats', action='store_true', help="查看各 pack 文件的使用率")
+    parser.add_argument('--ratio', type=float, default=None, help="可回收比例超过该值时整理")
+    parser.add_argument('--interval', type=float, default=None, help="整理间隔(秒)")
+    args = parser.parse_args()
+
+    if args.stats:
+        for stat in pack_stats():
+            print(
+                f"{stat['id']} {stat['file_path']} {'已封存' if stat['sealed'] else '写入中'} "
+                f"{stat['live_files']}个文件 {stat['live_bytes']}/{stat['size']}字节 可回收{stat['dead_ratio']:.0%}"
+            )
+    elif args.once:
+        print(compact_packs(args.ratio))
+    else:
+        try:
+            run_compactor(args.interval, args.ratio)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,168 @@
+"""
+平衡多个上传目录的使用率
+
+上传目录所在磁盘的使用率超过 crypto.rebalance_threshold 时, 从大到小把其中的文件移到其他磁盘上的上传目录,
+直到使用率降到 crypto.rebalance_target. 每个文件:
+    1. 限速复制到目标目录, 复制的同时计算摘要, 与数据库中记录的摘要不一致时放弃移动
+    2. 按落盘策略同步后, 修改数据库中的路径和上传目录(只修改路径没有变化的记录)
+    3. 删除原文件
+任意一步中断, 数据库指向的都是完整的密文, 残留的副本由 module.gc_apis 回收.
+
+用法:
+    python -m module.rebalance_apis            # 持续运行, 每 crypto.rebalance_interval 秒检查一次
+    python -m module.rebalance_apis --once     # 只检查一次
+    python -m module.rebalance_apis --status   # 查看各上传目录的使用率
+"""
+
+import argparse
+import os
+import shutil
+import threading
+from pathlib import Path
+
+from db_data.manager import db
+from module.blob_apis import HASH_CHUNK_SIZE, atomic_write, choose_root, flush_blobs, new_blob_path, upload_roots
+from module.common import RateLimiter
+from setting.config_loader import config
+
+REBALANCE_BATCH = 50  # 每次从数据库读取的文件数
+
+
+def root_usage() -> list:
+    """各上传目录所在磁盘的容量、剩余空间和使用率"""
+    usage = []
+    for root, weight in upload_roots():
+        os.makedirs(root, exist_ok=True)
+        disk = shutil.disk_usage(root)
+        usage.append({'root': root, 'weight': weight, 'total': disk.total, 'free': disk.free, 'used_ratio': 1 - disk.free / disk.total})
+    return usage
+
+
+def _used_ratio(root: str) -> float:
+    disk = shutil.disk_usage(root)
+    return 1 - disk.free / disk.total
+
+
+def _same_disk(root: str) -> set:
+    """与 root 在同一磁盘上的上传目录(包括 root), 它们之间移动文件不能腾出空间"""
+    device = os.stat(root).st_dev
+    return {other for other, _ in upload_roots() if os.path.exists(other) and os.stat(other).st_dev == device}
+
+
+def _copy_blob(file_dict: dict, new_path: Path, limiter: RateLimiter) -> bool:
+    """限速复制密文, 摘要与数据库中记录的不一致时删除副本并返回 False"""
+    buffer = memoryview(bytearray(HASH_CHUNK_SIZE))
+    with open(file_dict['file_path'], 'rb') as src, atomic_write(new_path) as dst:
+        while n := src.readinto(buffer):
+            limiter.acquire(n)
+            dst.write(buffer[:n])
+    if file_dict['blob_digest'] and dst.hexdigest() != file_dict['blob_digest']:
+        new_path.unlink(missing_ok=True)
+        return False
+    return True
+
+
+def rebalance_root(root: str, target_ratio: float = None, limiter: RateLimiter = None, stop_event: threading.Event = None) -> dict:
+    """
+    把上传目录中的文件移到其他磁盘上的上传目录, 直到使用率不超过 target_ratio
+    :param root: 需要腾出空间的上传目录
+    :param target_ratio: 目标使用率, 默认 crypto.rebalance_target
+    :param limiter: 复制限速, 默认按 crypto.rebalance_rate_limit 限速
+    :param stop_event: 设置后移动完当前文件即返回
+    :return: 统计结果
+    """
+    target_ratio = config.crypto.rebalance_target if target_ratio is None else target_ratio
+    limiter = limiter or RateLimiter(config.crypto.rebalance_rate_limit)
+    stop_event = stop_event or threading.Event()
+    same_disk = _same_disk(root)
+    summary = {'moved': 0, 'moved_bytes': 0, 'skipped': 0}
+    skipped = set()  # 丢失、损坏或移动过程中被修改的文件, 本次不再尝试
+    no_space = False
+    while _used_ratio(root) > target_ratio and not stop_event.is_set() and not no_space:
+        files = [f for f in db.get_root_files(root, config.path.upload, REBALANCE_BATCH + len(skipped)) if f['id'] not in skipped]
+        if not files:
+            break
+        moves = []
+        for file_dict in files[:REBALANCE_BATCH]:
+            if stop_event.is_set():
+                break
+            try:
+                target = choose_root(exclude=same_disk)
+            except OSError:
+                no_space = True  # 其他磁盘也没有空间
+                break
+            new_path = new_blob_path(file_dict['user_name'], file_dict['file_name'], root=target)
+            try:
+                copied = _copy_blob(file_dict, new_path, limiter)
+            except FileNotFoundError:
+                copied = False
+            if copied:
+                moves.append((file_dict, new_path, target))
+            else:
+                skipped.add(file_dict['id'])
+        flush_blobs()  # batch 落盘策略下, 修改数据库前保证副本已经落盘
+        moved = set(db.move_blob_paths([(f['id'], f['file_path'], new_path.as_posix(), target) for f, new_path, target in moves]))
+        for file_dict, new_path, _ in moves:
+            if file_dict['id'] in moved:
+                Path(file_dict['file_path']).unlink(missing_ok=True)
+                summary['moved'] += 1
+                summary['moved_bytes'] += new_path.stat().st_size
+            else:
+                new_path.unlink(missing_ok=True)
+                skipped.add(file_dict['id'])
+        print(f"平衡上传目录 {root}: 已移动{summary['moved']}个文件, 使用率{_used_ratio(root):.0%}")
+    summary['skipped'] = len(skipped)
+    return summary
+
+
+def rebalance(threshold: float = None, target_ratio: float = None, rate_limit: float = None, stop_event: threading.Event = None) -> dict:
+    """
+    检查所有上传目录, 平衡使用率超过 threshold 的目录
+    :param threshold: 默认 crypto.rebalance_threshold
+    :param target_ratio: 同 rebalance_root
+    :param rate_limit: 复制限速(字节/秒), 0 表示不限速, 默认 crypto.rebalance_rate_limit
+    :param stop_event: 同 rebalance_root
+    :return: 上传目录 -> 统计结果
+    """
+    threshold = config.crypto.rebalance_threshold if threshold is None else threshold
+    limiter = RateLimiter(config.crypto.rebalance_rate_limit if rate_limit is None else rate_limit)
+    result = {}
+    if len(upload_roots()) < 2:
+        return result
+    for usage in root_usage():
+        if usage['used_ratio'] > threshold:
+            result[usage['root']] = rebalance_root(usage['root'], target_ratio, limiter, stop_event)
+    return result
+
+
+def run_rebalancer(interval: float = None, stop_event: threading.Event = None):
+    """
+    持续在后台平衡上传目录
+    :param interval: 检查间隔(秒), 默认 crypto.rebalance_interval
+    :param stop_event: 设置后结束运行
+    """
+    interval = interval or config.crypto.rebalance_interval
+    stop_event = stop_event or threading.Event()
+    while not stop_event.is_set():
+        rebalance(stop_event=stop_event)
+        stop_event.wait(interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="平衡多个上传目录的使用率")
+    parser.add_argument('--once', action='store_true', help="只检查一次")
+    parser.add_argument('--status', action='store_true', help="查看各上传目录的使用率")
+    parser.add_argument('--rate', type=float, default=None, help="复制限速(字节/秒), 0 表示不限速")
+    parser.add_argument('--interval', type=float, default=None, help="检查间隔(秒)")
+    args = parser.parse_args()
+
+    if args.status:
+        for usage in root_usage():
+            print(f"{usage['root']} 权重{usage['weight']} 剩余{usage['free'] / 1024**3:.1f}GB 使用率{usage['used_ratio']:.0%}")
+    elif args.once:
+        print(rebalance(rate_limit=args.rate))
+    else:
+        try:
+            run_rebalancer(args.interval)
+        except KeyboardInterrupt:
+            pass
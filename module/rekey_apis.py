@@ -0,0 +1,160 @@
+"""
+批量重新加密任务(算法迁移)
+
+任务创建时把选中的文件记录到 sfg_rekey_item, 每个文件处理完立即记录状态, 进程崩溃或被中止后再次运行同一任务会从未完成的文件继续.
+每个文件通过 rekey_file 流式重新加密到新的密文文件, 数据库指向新文件后才删除原密文, 任意时刻中断都不会损坏文件.
+任务可以按字节数限速, 避免占满磁盘影响用户下载.
+
+用法:
+    python -m module.rekey_apis --target AES --source DES,3DES
+    python -m module.rekey_apis --resume 1 --rate 20M
+"""
+
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from db_data.manager import db
+from module.blob_apis import flush_blobs
+from module.cipher_registry import get_cipher
+from module.common import RateLimiter
+from module.file_apis import rekey_file
+from setting.config_loader import config
+from setting.global_variant import DELIMITER
+
+
+def create_rekey_job(target_algorithm: str, source_algorithms: list = None, user_name: str = None) -> int:
+    """
+    创建重新加密任务
+    :param target_algorithm: 目标加密算法
+    :param source_algorithms: 只迁移使用这些算法的文件, 不传时迁移所有不是目标算法的文件
+    :param user_name: 只迁移该用户的文件
+    :return: 任务id
+    """
+    get_cipher(target_algorithm)  # 校验算法名
+    return db.create_rekey_job(target_algorithm, source_algorithms, user_name)
+
+
+def get_rekey_progress(job_id: int, elapsed: float = None) -> dict:
+    """
+    任务进度: 文件数、字节数、吞吐量(MB/s) 和预计剩余时间(秒)
+    :param elapsed: 累计运行时间, 不传时使用数据库中记录的时间
+    """
+    job = db.get_rekey_job(job_id)
+    items = job['items']
+    total_files = sum(item['files'] for item in items.values())
+    total_bytes = sum(item['bytes'] for item in items.values())
+    remaining = {status: items.get(status, {'files': 0, 'bytes': 0}) for status in ('pending', 'running')}
+    remaining_bytes = sum(item['bytes'] for item in remaining.values())
+    elapsed = job['elapsed'] if elapsed is None else elapsed
+    throughput = (total_bytes - remaining_bytes) / elapsed if elapsed else 0
+    return {
+        'job_id': job_id,
+        'status': job['status'],
+        'target_algorithm': job['target_algorithm'],
+        'total_files': total_files,
+        'done_files': items.get('done', {}).get('files', 0),
+        'failed_files': items.get('failed', {}).get('files', 0),
+        'skipped_files': items.get('skipped', {}).get('files', 0),
+        'remaining_files': sum(item['files'] for item in remaining.values()),
+        'total_bytes': total_bytes,
+        'remaining_bytes': remaining_bytes,
+        'elapsed': round(elapsed, 1),
+        'mbps': round(throughput / 1024 / 1024, 2),
+        'eta': round(remaining_bytes / throughput, 1) if throughput else None,
+    }
+
+
+def _rekey_item(job: dict, item: dict, limiter: RateLimiter = None, stop_event: threading.Event = None) -> tuple:
+    """重新加密任务中的单个文件, 返回 (状态, 失败原因)"""
+    file = db.get_file_by_id(item['file_id'])
+    if not file:
+        return 'skipped', "文件已删除"
+    if file['algorithm'] == job['target_algorithm']:
+        return 'done', None  # 上次中断前已经完成, 只是没来得及记录
+    # 数据库中保存的是按原算法填充的密码, 去掉填充后按目标算法重新填充, 用户输入的密码不变
+    password = file['password'].lstrip(DELIMITER)
+    is_success, message = rekey_file(file, job['target_algorithm'], password, file['file_name'], limiter, stop_event)
+    if not is_success and stop_event is not None and stop_event.is_set():
+        return 'pending', None  # 停止时中止的文件, 下次继续时重新处理
+    return ('done', None) if is_success else ('failed', message)
+
+
+def run_rekey_job(job_id: int, workers: int = None, rate_limit: float = None, stop_event: threading.Event = None) -> dict:
+    """
+    运行(或继续)重新加密任务, 直到全部文件处理完或 stop_event 被设置
+    :param job_id: 任务id
+    :param workers: 并行处理的文件数, 默认 crypto.rekey_workers
+    :param rate_limit: 限速(字节/秒), 0 表示不限速, 默认 crypto.rekey_rate_limit
+    :param stop_event: 设置后不再开始新的文件, 进行中的文件在下一块中止并退回待处理, 任务状态为 paused
+    :return: 任务进度
+    """
+    job = db.get_rekey_job(job_id)
+    if not job:
+        raise ValueError(f"重新加密任务{job_id}不存在")
+    workers = workers or config.crypto.rekey_workers
+    limiter = RateLimiter(config.crypto.rekey_rate_limit if rate_limit is None else rate_limit)
+    stop_event = stop_event or threading.Event()
+    db.start_rekey_job(job_id)
+    started = time.monotonic()
+
+    def elapsed() -> float:
+        return job['elapsed'] + time.monotonic() - started
+
+    def process(item: dict):
+        if stop_event.is_set():
+            return
+        db.update_rekey_item(job_id, item['file_id'], 'running')
+        # 解密时按块限速, 限速等待不会超过一块的时间, 设置 stop_event 后在下一块中止
+        status, error = _rekey_item(job, item, limiter, stop_event)
+        db.update_rekey_item(job_id, item['file_id'], status, error, elapsed())
+        progress = get_rekey_progress(job_id, elapsed())
+        eta = '未知' if progress['eta'] is None else f"{progress['eta']}秒"
+        print(
+            f"重新加密任务{job_id}: 文件{item['file_id']} {status}, "
+            f"剩余{progress['remaining_files']}/{progress['total_files']}个文件, {progress['mbps']}MB/s, 预计剩余{eta}"
+        )
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            try:
+                for _ in pool.map(process, db.get_rekey_items(job_id, 'pending')):
+                    pass
+            except BaseException:
+                stop_event.set()  # 出错或 Ctrl+C 时不再开始新的文件, 等待进行中的文件完成
+                raise
+    finally:
+        flush_blobs()  # batch 落盘策略下, 任务结束前同步剩余的文件
+        db.finish_rekey_job(job_id, 'paused' if stop_event.is_set() else 'done', elapsed())
+    return get_rekey_progress(job_id)
+
+
+def _parse_rate(text: str) -> float:
+    """解析 20M / 512K 形式的速率"""
+    units = {'K': 1024, 'M': 1024**2, 'G': 1024**3}
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in units:
+        return float(text[:-1]) * units[text[-1]]
+    return float(text or 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量重新加密(算法迁移)")
+    parser.add_argument('--target', help="目标加密算法, 创建新任务时必填")
+    parser.add_argument('--source', default='', help="只迁移使用这些算法的文件, 逗号分隔")
+    parser.add_argument('--user', default=None, help="只迁移该用户的文件")
+    parser.add_argument('--resume', type=int, help="继续运行指定id的任务")
+    parser.add_argument('--workers', type=int, default=None, help="并行处理的文件数")
+    parser.add_argument('--rate', default=None, help="限速, 如 20M 表示每秒20MB, 0 表示不限速")
+    args = parser.parse_args()
+
+    if args.resume:
+        job_id = args.resume
+    elif args.target:
+        job_id = create_rekey_job(args.target, [name for name in args.source.split(',') if name], args.user)
+    else:
+        parser.error("需要指定 --target 或 --resume")
+
+    # Ctrl+C 中止后任务状态为 paused, 使用 --resume 继续
+    print(run_rekey_job(job_id, args.workers, None if args.rate is None else _parse_rate(args.rate)))
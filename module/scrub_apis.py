@@ -0,0 +1,137 @@
+"""
+后台密文校验
+
+按文件id顺序逐个校验密文摘要, 不需要密码. 每个周期(crypto.scrub_interval)最多读取 crypto.scrub_budget 字节,
+读取速度限制在 crypto.scrub_rate_limit 以内, 不会和用户下载争抢磁盘.
+校验进度保存在 sfg_scrub_state 中, 重启后从上次的位置继续, 校验到最后一个文件后从头开始下一轮.
+发现的损坏或丢失的密文记录在 sfg_blob_fault 中, 管理员可通过 get_blob_faults 或 --faults 查询.
+
+用法:
+    python -m module.scrub_apis            # 持续运行, Ctrl+C 停止
+    python -m module.scrub_apis --once     # 只运行一个周期
+    python -m module.scrub_apis --faults   # 查看损坏或丢失的密文
+"""
+
+import argparse
+import threading
+import time
+
+from db_data.manager import db
+from module.blob_apis import blob_size, check_blob
+from module.common import RateLimiter
+from setting.config_loader import config
+
+SCRUB_BATCH = 100  # 每次从数据库读取的文件数
+
+
+def _blob_size(file_dict: dict) -> int:
+    try:
+        return blob_size(file_dict)
+    except OSError:
+        return 0
+
+
+# 决定密文位置和内容的列, 任意一列变化说明密文已被移动或重新加密
+BLOB_COLUMNS = ('file_path', 'blob_digest', 'pack_segment', 'pack_offset', 'pack_length', 'blob_root')
+
+
+def _check_file(file_dict: dict, limiter: RateLimiter) -> tuple:
+    """
+    校验一个文件的密文, 校验失败时重新读取文件记录, 避免把校验期间被移动、重新加密或删除的文件误记为故障
+    :return: (文件记录, 状态), 文件已被删除时返回 (None, None)
+    """
+    status = check_blob(file_dict, limiter=limiter)
+    while status in ('corrupt', 'missing'):
+        current = db.get_file_by_id(file_dict['id'])
+        if not current:
+            return None, None
+        if all(current[key] == file_dict[key] for key in BLOB_COLUMNS):
+            break
+        file_dict = current
+        status = check_blob(file_dict, limiter=limiter)
+    return file_dict, status
+
+
+def scrub_step(budget: int = None, limiter: RateLimiter = None, stop_event: threading.Event = None) -> dict:
+    """
+    从上次的位置继续校验, 读取的密文达到 budget 字节或完成一轮后返回
+    :param budget: 本次最多读取的字节数, 默认 crypto.scrub_budget
+    :param limiter: 读取限速, 默认按 crypto.scrub_rate_limit 限速
+    :param stop_event: 设置后校验完当前文件即返回
+    :return: 本次校验的统计
+    """
+    budget = budget or config.crypto.scrub_budget
+    limiter = limiter or RateLimiter(config.crypto.scrub_rate_limit)
+    stop_event = stop_event or threading.Event()
+    cursor = db.get_scrub_state()['cursor']
+    summary = {'ok': 0, 'corrupt': 0, 'missing': 0, 'unknown': 0, 'bytes': 0, 'round_finished': False}
+    while summary['bytes'] < budget and not stop_event.is_set():
+        files = db.get_files_after(cursor, SCRUB_BATCH)
+        if not files:
+            cursor = 0
+            summary['round_finished'] = True
+            break
+        results = []
+        for file_dict in files:
+            cursor = file_dict['id']
+            file_dict, status = _check_file(file_dict, limiter)
+            if file_dict is None:
+                continue  # 校验期间已被删除
+            summary['bytes'] += _blob_size(file_dict)
+            results.append((file_dict['id'], file_dict['file_path'], status))
+            summary[status] += 1
+            if summary['bytes'] >= budget or stop_event.is_set():
+                break
+        db.update_blob_faults(results)
+        db.set_scrub_cursor(cursor)  # 每批记录一次进度, 中断后最多重复校验一批
+    if summary['round_finished']:
+        db.set_scrub_cursor(cursor, finish_round=True)
+    summary['cursor'] = cursor
+    return summary
+
+
+def run_scrubber(interval: float = None, budget: int = None, rate_limit: float = None, stop_event: threading.Event = None):
+    """
+    持续运行后台校验, 每个周期校验 budget 字节, 提前完成时等待到周期结束
+    :param interval: 周期时长(秒), 默认 crypto.scrub_interval
+    :param budget: 每个周期最多读取的字节数, 默认 crypto.scrub_budget
+    :param rate_limit: 读取限速(字节/秒), 0 表示不限速, 默认 crypto.scrub_rate_limit
+    :param stop_event: 设置后结束运行
+    """
+    interval = interval or config.crypto.scrub_interval
+    limiter = RateLimiter(config.crypto.scrub_rate_limit if rate_limit is None else rate_limit)
+    stop_event = stop_event or threading.Event()
+    while not stop_event.is_set():
+        started = time.monotonic()
+        summary = scrub_step(budget, limiter, stop_event)
+        print(
+            f"后台校验: 完整{summary['ok']}个, 损坏{summary['corrupt']}个, 丢失{summary['missing']}个, "
+            f"无摘要{summary['unknown']}个, 读取{summary['bytes'] / 1024 / 1024:.1f}MB, 下次从文件{summary['cursor']}之后开始"
+        )
+        stop_event.wait(max(0.0, interval - (time.monotonic() - started)))
+
+
+def get_blob_faults() -> list:
+    """查询后台校验发现的损坏或丢失的密文"""
+    return db.get_blob_faults()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="后台校验密文完整性")
+    parser.add_argument('--once', action='store_true', help="只运行一个周期")
+    parser.add_argument('--faults', action='store_true', help="查看损坏或丢失的密文")
+    parser.add_argument('--interval', type=float, default=None, help="周期时长(秒)")
+    parser.add_argument('--budget', type=int, default=None, help="每个周期最多读取的字节数")
+    parser.add_argument('--rate', type=float, default=None, help="读取限速(字节/秒), 0 表示不限速")
+    args = parser.parse_args()
+
+    if args.faults:
+        for fault in get_blob_faults():
+            print(fault)
+    elif args.once:
+        print(scrub_step(args.budget, RateLimiter(config.crypto.scrub_rate_limit if args.rate is None else args.rate)))
+    else:
+        try:
+            run_scrubber(args.interval, args.budget, args.rate)
+        except KeyboardInterrupt:
+            pass  # 进度已保存, 下次从中断的位置继续
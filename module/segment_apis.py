@@ -0,0 +1,343 @@
+"""
+分段密文格式(可随机读取)
+
+文件结构: 文件头 + 若干个独立加密的分段
+    文件头: 魔数(6字节) + 版本号(2字节) + 分段明文长度(4字节)
+    分段:   随机nonce/IV + 密文 + 认证标签(16字节)
+
+每个分段都有独立的nonce和认证标签, 附加认证数据为 文件头+分段序号+是否最后一段,
+因此分段被篡改、调换顺序或文件被截断都能被检测出来.
+注册了GCM后端的算法(AES/SM4)使用 GCM 模式, 其余(DES/3DES)没有AEAD模式, 使用 CBC + HMAC-SHA256(先加密后认证).
+"""
+
+import atexit
+import hashlib
+import hmac
+import multiprocessing
+import os
+import struct
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+
+from cryptography.exceptions import InvalidTag
+
+from module.cipher_registry import PADDING, apply_backends, current_backends, get_cipher
+
+MAGIC = b'SFGSEG'
+VERSION = 1
+HEADER = struct.Struct('>6sHI')  # 魔数, 版本号, 分段明文长度
+SEGMENT_AAD = struct.Struct('>QB')  # 分段序号, 是否最后一段
+TAG_SIZE = 16
+GCM_NONCE_SIZE = 12
+TASK_SIZE = 1024 * 1024  # 并行时每个任务处理的明文长度, 多个分段合并为一个任务, 摊薄调度和进程间传输的开销
+_process_pool = None  # (工作数, 加密后端, 进程池), 多次调用共用, 避免每个文件重新启动子进程
+_process_pool_lock = threading.Lock()
+
+
+@lru_cache(maxsize=16)
+def _mac_key(key: bytes) -> bytes:
+    """由数据密钥派生HMAC密钥, 避免加密和认证使用同一个密钥"""
+    return hashlib.sha256(b'SFG-SEGMENT-MAC' + key).digest()
+
+
+def segment_disk_size(algorithm: str, plain_len: int) -> int:
+    """分段明文长度对应的磁盘占用长度"""
+    spec = get_cipher(algorithm)
+    if spec.aead:
+        return GCM_NONCE_SIZE + plain_len + TAG_SIZE
+    return spec.iv_size + (plain_len // spec.block_size + 1) * spec.block_size + TAG_SIZE
+
+
+def seal_segment_into(algorithm: str, key: bytes, aad: bytes, data, out) -> int:
+    """
+    加密并认证单个分段, 写入预分配的缓冲区
+    :param data: 分段明文(bytes/memoryview)
+    :param out: 输出缓冲区(memoryview), 长度不小于 segment_disk_size + 分组长度
+    :return: 写入的字节数
+    """
+    spec = get_cipher(algorithm)
+    if spec.aead:
+        nonce = os.urandom(GCM_NONCE_SIZE)
+        out[:GCM_NONCE_SIZE] = nonce
+        encryptor = spec.gcm_factory(key, nonce)
+        encryptor.authenticate_additional_data(aad)
+        size = GCM_NONCE_SIZE + encryptor.update_into(data, out[GCM_NONCE_SIZE:])
+        encryptor.finalize()
+        out[size : size + TAG_SIZE] = encryptor.tag
+        return size + TAG_SIZE
+
+    iv = os.urandom(spec.iv_size)
+    out[: spec.iv_size] = iv
+    ctx = spec.new_cbc(key, iv)
+    full = len(data) // spec.block_size * spec.block_size
+    size = spec.iv_size + ctx.update_into(data[:full], out[spec.iv_size :])
+    # 只有最后不足一个分组的部分需要和填充拼接
+    pad_len = spec.block_size - (len(data) - full)
+    size += ctx.update_into(bytes(data[full:]) + PADDING[pad_len], out[size:])
+    mac = hmac.new(_mac_key(key), aad, hashlib.sha256)
+    mac.update(out[:size])
+    out[size : size + TAG_SIZE] = mac.digest()[:TAG_SIZE]
+    return size + TAG_SIZE
+
+
+def open_segment_into(algorithm: str, key: bytes, aad: bytes, blob, out) -> int:
+    """
+    校验并解密单个分段, 写入预分配的缓冲区, 认证失败抛出 InvalidTag
+    :param blob: 分段密文(bytes/memoryview)
+    :param out: 输出缓冲区(memoryview), 长度不小于 分段明文长度 + 2*分组长度
+    :return: 写入的明文字节数
+    """
+    spec = get_cipher(algorithm)
+    blob = memoryview(blob)
+    if spec.aead:
+        decryptor = spec.gcm_factory(key, bytes(blob[:GCM_NONCE_SIZE]), bytes(blob[-TAG_SIZE:]))
+        decryptor.authenticate_additional_data(aad)
+        size = decryptor.update_into(blob[GCM_NONCE_SIZE:-TAG_SIZE], out)
+        decryptor.finalize()
+        return size
+
+    mac = hmac.new(_mac_key(key), aad, hashlib.sha256)
+    mac.update(blob[:-TAG_SIZE])
+    if not hmac.compare_digest(blob[-TAG_SIZE:], mac.digest()[:TAG_SIZE]):
+        raise InvalidTag()
+    ctx = spec.new_cbc(key, bytes(blob[: spec.iv_size]), decrypt=True)
+    size = ctx.update_into(blob[spec.iv_size : -TAG_SIZE], out)
+    return size - out[size - 1]  # 去除 PKCS7 填充
+
+
+def seal_segment(algorithm: str, key: bytes, aad: bytes, data: bytes) -> bytearray:
+    """加密并认证单个分段, 返回新的缓冲区(用于并行任务)"""
+    out = bytearray(segment_disk_size(algorithm, len(data)) + 16)
+    with memoryview(out) as view:
+        size = seal_segment_into(algorithm, key, aad, data, view)
+    del out[size:]
+    return out
+
+
+def open_segment(algorithm: str, key: bytes, aad: bytes, blob: bytes) -> bytearray:
+    """校验并解密单个分段, 返回新的缓冲区(用于并行任务和随机读取)"""
+    out = bytearray(len(blob) + 32)
+    with memoryview(out) as view:
+        size = open_segment_into(algorithm, key, aad, blob, view)
+    del out[size:]
+    return out
+
+
+def _segment_aad(header: bytes, index: int, is_last: bool) -> bytes:
+    return header + SEGMENT_AAD.pack(index, is_last)
+
+
+def read_header(src) -> tuple:
+    """读取并校验文件头, 返回 (文件头字节, 分段明文长度)"""
+    return parse_header(src.read(HEADER.size))
+
+
+def parse_header(header: bytes) -> tuple:
+    """校验文件头, 返回 (文件头字节, 分段明文长度)"""
+    if len(header) != HEADER.size:
+        raise ValueError("密文文件头不完整")
+    magic, version, segment_size = HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("不是受支持的分段密文格式")
+    return header, segment_size
+
+
+def _run_batch(func, jobs: list) -> list:
+    """在一个任务中顺序处理多个分段"""
+    return [func(*job) for job in jobs]
+
+
+def _shared_process_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    共用的进程池, 工作数或加密后端变化时重建
+    使用 spawn 启动子进程: 会在多线程中调用(重新加密任务、批量校验), fork 时其他线程持有的锁(sqlite、日志等)会被复制到子进程中, 可能死锁
+    """
+    global _process_pool
+    backends = current_backends()
+    with _process_pool_lock:
+        if _process_pool is None or _process_pool[:2] != (workers, backends):
+            if _process_pool is not None:
+                _process_pool[2].shutdown(wait=False)
+            # 子进程使用与主进程相同的加密后端
+            pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=apply_backends, initargs=(backends,)
+            )
+            _process_pool = (workers, backends, pool)
+        return _process_pool[2]
+
+
+@atexit.register
+def _shutdown_process_pool():
+    if _process_pool is not None:
+        _process_pool[2].shutdown(cancel_futures=True)
+
+
+def _batched(jobs, batch: int):
+    """把参数元组的迭代器按 batch 个一组合并"""
+    group = []
+    for job in jobs:
+        group.append(job)
+        if len(group) >= batch:
+            yield group
+            group = []
+    if group:
+        yield group
+
+
+def _ordered_map(func, jobs, workers: int, executor: str = 'thread', batch: int = 1):
+    """
+    有序并行map, 按提交顺序返回结果
+    同时在途的任务数限制为 workers*2, 保证内存占用不随文件大小增长
+    :param func: 模块级函数(多进程时需要可被pickle)
+    :param jobs: 参数元组的迭代器
+    :param workers: 并行数, 小于等于1时在当前线程顺序执行
+    :param executor: thread(多线程, cryptography 加解密时释放GIL) / process(共用的多进程池)
+    :param batch: 每个任务处理的参数个数
+    """
+    if workers <= 1:
+        for job in jobs:
+            yield func(*job)
+        return
+
+    thread_pool = ThreadPoolExecutor(max_workers=workers) if executor == 'thread' else None
+    pool = thread_pool or _shared_process_pool(workers)
+    pending = deque()
+    try:
+        for group in _batched(jobs, batch):
+            pending.append(pool.submit(_run_batch, func, group))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()  # 调用方提前结束(如写入失败)时不再处理剩余的分段
+        if thread_pool is not None:
+            thread_pool.shutdown()
+
+
+def _iter_chunks(src, size: int):
+    """按固定长度读取输入流, 预读下一块以判断是否为最后一块, 生成 (序号, 是否最后一块, 数据)"""
+    index = 0
+    chunk = src.read(size)
+    while True:
+        next_chunk = src.read(size) if len(chunk) == size else b''
+        is_last = not next_chunk
+        yield index, is_last, chunk
+        if is_last:
+            return
+        chunk = next_chunk
+        index += 1
+
+
+def _iter_views(src, size: int):
+    """
+    _iter_chunks 的零拷贝版本: 两个预分配缓冲区交替 readinto, 生成 (序号, 是否最后一块, memoryview)
+    生成的视图在下一次迭代时会被覆盖, 只能用于顺序处理
+    """
+    current, following = memoryview(bytearray(size)), memoryview(bytearray(size))
+    index = 0
+    n = src.readinto(current)
+    while True:
+        m = src.readinto(following) if n == size else 0
+        is_last = not m
+        yield index, is_last, current[:n]
+        if is_last:
+            return
+        current, following = following, current
+        n = m
+        index += 1
+
+
+def encrypt_segmented(algorithm: str, key: bytes, src, dst, segment_size: int, workers: int = 1, executor: str = 'thread'):
+    """将明文流按分段加密写入输出流, 至少写入一个(最后)分段, workers>1 时并行加密并按顺序写入"""
+    header = HEADER.pack(MAGIC, VERSION, segment_size)
+    dst.write(header)
+    if workers > 1:
+        jobs = ((algorithm, key, _segment_aad(header, index, is_last), chunk) for index, is_last, chunk in _iter_chunks(src, segment_size))
+        for blob in _ordered_map(seal_segment, jobs, workers, executor, max(TASK_SIZE // segment_size, 1)):
+            dst.write(blob)
+        return
+
+    # 单线程时复用预分配的缓冲区
+    out = memoryview(bytearray(segment_disk_size(algorithm, segment_size) + 16))
+    for index, is_last, chunk in _iter_views(src, segment_size):
+        dst.write(out[: seal_segment_into(algorithm, key, _segment_aad(header, index, is_last), chunk, out)])
+
+
+def decrypt_segmented(algorithm: str, key: bytes, src, dst, workers: int = 1, executor: str = 'thread') -> int:
+    """解密整个分段密文流到输出流, 返回写入的明文字节数, workers>1 时并行解密并按顺序写入"""
+    header, segment_size = read_header(src)
+    disk_size = segment_disk_size(algorithm, segment_size)
+    written = 0
+    if workers > 1:
+        jobs = ((algorithm, key, _segment_aad(header, index, is_last), blob) for index, is_last, blob in _iter_chunks(src, disk_size))
+        for plaintext in _ordered_map(open_segment, jobs, workers, executor, max(TASK_SIZE // segment_size, 1)):
+            written += dst.write(plaintext)
+        return written
+
+    # 单线程时复用预分配的缓冲区
+    out = memoryview(bytearray(segment_size + 32))
+    for index, is_last, blob in _iter_views(src, disk_size):
+        written += dst.write(out[: open_segment_into(algorithm, key, _segment_aad(header, index, is_last), blob, out)])
+    return written
+
+
+def segmented_capacity(algorithm: str, plain_size: int, segment_size: int) -> int:
+    """分段密文长度上限(含 update_into 需要的额外空间), 用于预分配内存映射的输出文件"""
+    segment_count = max(-(-plain_size // segment_size), 1)
+    return HEADER.size + segment_count * segment_disk_size(algorithm, segment_size) + 16
+
+
+def encrypt_segmented_view(algorithm: str, key: bytes, src_view, dst_view, segment_size: int) -> int:
+    """
+    在内存映射视图之间分段加密, 返回写入的字节数
+    :param dst_view: 输出视图, 长度不小于 segmented_capacity
+    """
+    header = HEADER.pack(MAGIC, VERSION, segment_size)
+    dst_view[: HEADER.size] = header
+    written = HEADER.size
+    segment_count = max(-(-len(src_view) // segment_size), 1)
+    for index in range(segment_count):
+        chunk = src_view[index * segment_size : (index + 1) * segment_size]
+        aad = _segment_aad(header, index, index == segment_count - 1)
+        written += seal_segment_into(algorithm, key, aad, chunk, dst_view[written:])
+    return written
+
+
+def decrypt_segmented_view(algorithm: str, key: bytes, src_view, dst_view) -> int:
+    """
+    在内存映射视图之间解密整个分段密文, 返回写入的明文字节数
+    :param dst_view: 输出视图, 长度不小于 密文长度 + 32
+    """
+    header, segment_size = parse_header(bytes(src_view[: HEADER.size]))
+    disk_size = segment_disk_size(algorithm, segment_size)
+    segment_count = max(-(-(len(src_view) - HEADER.size) // disk_size), 1)  # 没有分段时按空分段校验, 截断的文件会认证失败
+    written = 0
+    for index in range(segment_count):
+        start = HEADER.size + index * disk_size
+        aad = _segment_aad(header, index, index == segment_count - 1)
+        written += open_segment_into(algorithm, key, aad, src_view[start : start + disk_size], dst_view[written:])
+    return written
+
+
+def decrypt_segment_range(algorithm: str, key: bytes, src, offset: int, length: int) -> bytes:
+    """只解密 [offset, offset+length) 涉及到的分段"""
+    header, segment_size = read_header(src)
+    disk_size = segment_disk_size(algorithm, segment_size)
+    body_size = src.seek(0, os.SEEK_END) - HEADER.size  # 同时支持文件和内存中的 pack 密文
+    segment_count = -(-body_size // disk_size)  # 向上取整
+    if length <= 0 or offset < 0:
+        return b''
+
+    first = offset // segment_size
+    last = min((offset + length - 1) // segment_size, segment_count - 1)
+    parts = []
+    for index in range(first, last + 1):
+        src.seek(HEADER.size + index * disk_size)
+        blob = src.read(disk_size)
+        parts.append(open_segment(algorithm, key, _segment_aad(header, index, index == segment_count - 1), blob))
+    start = offset - first * segment_size
+    return b''.join(parts)[start : start + length]
@@ -107,6 +107,19 @@ def get_user_list(current_user: dict, query: str = '') -> list:
     return db.get_user_list(params, query)
 
 
+def get_user_page(
+    current_user: dict, query: str = '', cursor: str = None, page_size: int = None, sort: str = 'username', direction: str = 'asc', with_total: bool = False
+) -> dict:
+    """
+    分页查找用户列表, 参数和返回值见 DBManager.get_user_page
+    :param cursor: 上一页返回的 next_cursor, 为空表示第一页
+    """
+    params = {}
+    if current_user['role'] != 'admin':
+        params['username'] = current_user['username']
+    return db.get_user_page(params, query, page_size, sort, direction, cursor, with_total)
+
+
 def delete_user(current_user: dict, username: str) -> bool:
     """删除用户"""
     if current_user['role'] != 'admin':